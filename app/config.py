@@ -9,4 +9,62 @@ POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 DATABASE_URL = (
     f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@"
     f"{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-)
\ No newline at end of file
+)
+
+# 連線池: 啟動 warm-up 時會先開滿 DB_POOL_SIZE 條連線
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# 啟動 warm-up 失敗時重試的等待秒數，每次加倍，最多 WARMUP_RETRY_MAX_SECONDS
+WARMUP_RETRY_INITIAL_SECONDS = float(os.getenv("WARMUP_RETRY_INITIAL_SECONDS", "1"))
+WARMUP_RETRY_MAX_SECONDS = float(os.getenv("WARMUP_RETRY_MAX_SECONDS", "30"))
+
+# 購買紀錄欄式快照目錄 (空字串 = 停用，分析查詢直接走資料庫)
+PURCHASE_SNAPSHOT_DIR = os.getenv("PURCHASE_SNAPSHOT_DIR", "")
+
+# purchase_histories 月份 partition: 預先建立幾個月後的 partition、保留幾個月 (0 = 不 detach)
+# 保留期限只由 cron 入口 `python -m app.utils.partitions` 套用，worker 啟動時不 detach
+PURCHASE_PARTITION_MONTHS_AHEAD = int(os.getenv("PURCHASE_PARTITION_MONTHS_AHEAD", "3"))
+PURCHASE_RETENTION_MONTHS = int(os.getenv("PURCHASE_RETENTION_MONTHS", "0"))
+
+# Admission control: 每個路由類別的 (同時處理上限, 等待佇列長度)
+# 上限總和不要超過 DB 連線池大小 (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+ADMISSION_LIMITS = {
+    "writes": (int(os.getenv("ADMISSION_WRITES_LIMIT", "6")),
+               int(os.getenv("ADMISSION_WRITES_QUEUE", "32"))),
+    "catalog": (int(os.getenv("ADMISSION_CATALOG_LIMIT", "6")),
+                int(os.getenv("ADMISSION_CATALOG_QUEUE", "32"))),
+    "analytics": (int(os.getenv("ADMISSION_ANALYTICS_LIMIT", "2")),
+                  int(os.getenv("ADMISSION_ANALYTICS_QUEUE", "4"))),
+}
+# 排隊最多等幾秒，逾時回 503
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+# 503 回應的 Retry-After (秒)
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+# 商品字典與 /search/suggest 前綴索引的更新間隔 (秒)
+SUGGEST_REFRESH_SECONDS = float(os.getenv("SUGGEST_REFRESH_SECONDS", "60"))
+# /pharmacies/cheapest 比價索引檢查版本的間隔 (秒)；版本沒變時只跑兩個小查詢
+OFFER_REFRESH_SECONDS = float(os.getenv("OFFER_REFRESH_SECONDS", "5"))
+# 檢查購買紀錄快照是否仍是最新的間隔 (秒)；期間內新增的舊日期紀錄最多晚這麼久才改查資料庫
+SNAPSHOT_CHECK_SECONDS = float(os.getenv("SNAPSHOT_CHECK_SECONDS", "5"))
+# 藥局營業時間所在時區 (open_now 以此時區的現在時間判斷)
+OPENING_HOURS_TZ = os.getenv("OPENING_HOURS_TZ", "UTC")
+
+# 回應壓縮: 小於 COMPRESSION_MIN_SIZE bytes 不壓縮
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# 批次查詢 (?ids=) 一次最多幾個 id
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", "500"))
+
+# 單一請求 profiling (兩者皆未設定時不啟用，零開銷)
+# PROFILE_TOKEN: 請求帶 X-Profile: <token> 時 profile；PROFILE_SAMPLE_RATE: 隨機抽樣比例 (0~1)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/kdan-profiles")
+# PROFILE_DIR 最多保留幾份 profile，超過時刪除最舊的
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+# 取樣間隔 (秒)
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
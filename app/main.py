@@ -1,18 +1,90 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .database import Base, engine
+from fastapi.responses import JSONResponse
+from .database import engine
+from .config import (
+    ADMISSION_RETRY_AFTER, SUGGEST_REFRESH_SECONDS, OFFER_REFRESH_SECONDS, SNAPSHOT_CHECK_SECONDS,
+    COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY
+)
 from .routers import pharmacies, users, search
+from .utils.admission import AdmissionControlMiddleware, build_gates
+from .utils.compression import CompressionMiddleware
+from .utils.profiling import install_profiling
+from .utils.warmup import (
+    is_ready, refresh_catalog_indexes, refresh_offer_index, refresh_snapshot_status, stop_warm_up, warm_up
+)
+
+logger = logging.getLogger(__name__)
 
-# 若想在首次啟動時自動建表 (僅開發環境建議)
-# 不建議生產環境自動執行，避免破壞既有資料
-Base.metadata.create_all(bind=engine)
+async def refresh_periodically(interval: float, refresh, name: str):
+    """定期更新記憶體內索引 / 快照狀態"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        if not is_ready():
+            continue
+        try:
+            await loop.run_in_executor(None, refresh)
+        except Exception:
+            logger.exception("%s refresh failed", name)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 背景執行 warm-up (建表、開連線池、預跑熱門查詢)，完成前 /ready 回 503
+    warmup_future = asyncio.get_running_loop().run_in_executor(None, warm_up)
+    refresh_tasks = [
+        asyncio.create_task(refresh_periodically(SUGGEST_REFRESH_SECONDS, refresh_catalog_indexes, "catalog index")),
+        asyncio.create_task(refresh_periodically(OFFER_REFRESH_SECONDS, refresh_offer_index, "offer index")),
+        asyncio.create_task(refresh_periodically(SNAPSHOT_CHECK_SECONDS, refresh_snapshot_status, "snapshot status")),
+    ]
+    yield
+    for task in refresh_tasks:
+        task.cancel()
+    stop_warm_up()
+    warmup_future.cancel()
 
 app = FastAPI(
     title="Pharmacy Platform API",
     description="簡易的藥局平台後端",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 將路由掛進主 app
 app.include_router(pharmacies.router)
 app.include_router(users.router)
-app.include_router(search.router)
\ No newline at end of file
+app.include_router(search.router)
+
+# 依 Accept-Encoding 壓縮較大的回應 (br / gzip)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=COMPRESSION_MIN_SIZE,
+    gzip_level=COMPRESSION_GZIP_LEVEL,
+    brotli_quality=COMPRESSION_BROTLI_QUALITY
+)
+
+# 依路由類別限制同時處理數，超量時快速回 503
+admission_gates = build_gates()
+app.add_middleware(AdmissionControlMiddleware, gates=admission_gates, retry_after=ADMISSION_RETRY_AFTER)
+
+# 選用的單一請求 profiling (PROFILE_TOKEN / PROFILE_SAMPLE_RATE 未設定時不安裝)；
+# 最後加入 = 最外層，量到的時間包含 admission control 排隊與壓縮
+install_profiling(app, engine)
+
+@app.get("/metrics/admission", tags=["Metrics"])
+def admission_metrics():
+    """
+    各路由類別目前的處理中數量、佇列深度，以及累計放行 / 拒絕次數
+    """
+    return {name: gate.stats() for name, gate in admission_gates.items()}
+
+@app.get("/ready", tags=["Metrics"])
+def readiness():
+    """
+    Readiness probe：啟動 warm-up 完成後才回 200
+    """
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
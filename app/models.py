@@ -1,6 +1,6 @@
 # app/models.py
 from sqlalchemy import (
-    Column, Integer, Float, DateTime, ForeignKey, Time, String, Enum
+    BigInteger, Column, Integer, Float, DateTime, ForeignKey, Time, String, Enum
 )
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -39,15 +39,32 @@ class PharmacyOpeningHours(Base):
 
     pharmacy = relationship("Pharmacy", back_populates="opening_hours")
 
+class Product(Base):
+    __tablename__ = "products"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # 完整商品名稱，例如 "MaskT (green) (10 per pack)"
+    name = Column(String(255), nullable=False, unique=True)
+    # 由 name 解析出來的欄位 (app/utils/product_name.py)
+    brand = Column(String(255), nullable=False)
+    color = Column(String(64))
+    pack_size = Column(Integer)
+
 class Mask(Base):
     __tablename__ = "masks"
 
     id = Column(Integer, primary_key=True, index=True)
     pharmacy_id = Column(Integer, ForeignKey("pharmacies.id"), nullable=False)
-    name = Column(String(255), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
     price = Column(Float, default=0)
 
     pharmacy = relationship("Pharmacy", back_populates="masks")
+    # products 很小，直接 join 載入
+    product = relationship("Product", lazy="joined")
+
+    @property
+    def name(self):
+        return self.product.name if self.product else None
 
 class User(Base):
     __tablename__ = "users"
@@ -60,15 +77,34 @@ class User(Base):
 
 class PurchaseHistory(Base):
     __tablename__ = "purchase_histories"
+    # 依 transaction_date 按月 RANGE partition，partition 由 app/utils/partitions.py 管理
+    # (partition key 必須包含在主鍵內，所以主鍵是 (id, transaction_date))
+    __table_args__ = {"postgresql_partition_by": "RANGE (transaction_date)"}
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     pharmacy_id = Column(Integer, ForeignKey("pharmacies.id"), nullable=False)
     mask_id = Column(Integer, ForeignKey("masks.id"), nullable=True)
-    mask_name = Column(String(255))
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
     quantity = Column(Integer, default=1)
     transaction_amount = Column(Float, default=0)
-    transaction_date = Column(DateTime)
+    transaction_date = Column(DateTime, primary_key=True, index=True)
 
     user = relationship("User", back_populates="purchase_histories")
+    product = relationship("Product", lazy="joined")
     # 可選: relationship 到 mask / pharmacy，如需再加
+
+    @property
+    def mask_name(self):
+        return self.product.name if self.product else None
+
+class EntityVersion(Base):
+    """
+    各實體的版本號，寫入時遞增，用來產生 ETag (app/utils/versioning.py)
+    key 例如 "pharmacy:3"、"pharmacy_masks:3"、"user_purchases:7"、"epoch"
+    key 用 "C" collation，前綴查詢 (key >= 'pharmacy:' AND key < 'pharmacy;') 才能走主鍵索引
+    """
+    __tablename__ = "entity_versions"
+
+    key = Column(String(64, collation="C"), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
@@ -1,60 +1,210 @@
 # app/routers/pharmacies.py
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from datetime import time
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.orm import Session, contains_eager
+from typing import Dict, List, Optional, Set
+from datetime import datetime, time
+from zoneinfo import ZoneInfo
+from app.config import BATCH_MAX_IDS, OPENING_HOURS_TZ
 from app.database import get_db
-from app.models import Pharmacy, PharmacyOpeningHours, Mask
-from app.schemas import Pharmacy as PharmacySchema, Mask as MaskSchema
+from app.models import DayOfWeekEnum, Pharmacy, PharmacyOpeningHours, Mask, Product
+from app.schemas import Pharmacy as PharmacySchema, Mask as MaskSchema, MaskOffer
+from app.utils.fields import field_columns, fields_response, parse_fields, parse_ids, rows_to_dicts
+from app.utils.offer_index import offer_index
+from app.utils.product_catalog import product_catalog
 from app.utils.time_helper import is_open_now
+from app.utils.versioning import (
+    PHARMACY_PREFIX, check_etag, current_version, make_etag, pharmacy_masks_key
+)
+from app.utils.profiling import ProfiledRoute
 
-router = APIRouter(prefix="/pharmacies", tags=["Pharmacies"])
+router = APIRouter(prefix="/pharmacies", tags=["Pharmacies"], route_class=ProfiledRoute)
+
+# ?fields= 可選的欄位 -> SQL 欄位
+PHARMACY_COLUMNS = {"id": Pharmacy.id, "name": Pharmacy.name, "cash_balance": Pharmacy.cash_balance}
+MASK_COLUMNS = {
+    "id": Mask.id,
+    "pharmacy_id": Mask.pharmacy_id,
+    "product_id": Mask.product_id,
+    "name": Product.name,
+    "price": Mask.price,
+}
+
+def _mask_query(db: Session, names: Optional[List[str]], join_product: bool = False):
+    """names 為 None 時查完整的 Mask，否則只查指定欄位 (需要名稱時才 join products)"""
+    if names is None:
+        q = db.query(Mask)
+    else:
+        q = db.query(*field_columns(names, MASK_COLUMNS)).select_from(Mask)
+        join_product = join_product or "name" in names
+    if join_product:
+        q = q.join(Mask.product)
+        if names is None:
+            # 用 join 進來的 products 載入 Mask.product，不要再由 lazy="joined" join 第二次
+            q = q.options(contains_eager(Mask.product))
+    return q
+
+def _parse_time(time_str: str) -> time:
+    """"14:00" / "14" -> time；格式錯誤 (例如 "9am"、"25:00") 回 400"""
+    hour_min = time_str.split(":")
+    try:
+        if len(hour_min) > 2:
+            raise ValueError(time_str)
+        return time(int(hour_min[0]), int(hour_min[1]) if len(hour_min) > 1 else 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="time_str must be HH or HH:MM (24-hour)")
+
+def _open_pharmacy_ids(db: Session, day_of_week: str, check_time: time) -> Set[int]:
+    """一次撈出營業時間，回傳 day_of_week 當天 check_time 有營業的 pharmacy_id"""
+    rows = db.query(
+        PharmacyOpeningHours.pharmacy_id,
+        PharmacyOpeningHours.day_of_week,
+        PharmacyOpeningHours.open_time,
+        PharmacyOpeningHours.close_time
+    ).all()
+    return {
+        ph_id for ph_id, dow, open_t, close_t in rows
+        if dow.value == day_of_week and is_open_now(open_t, close_t, check_time)
+    }
 
 @router.get("/open", response_model=List[PharmacySchema])
-def get_open_pharmacies(day_of_week: Optional[str], time_str: Optional[str], db: Session = Depends(get_db)):
+def get_open_pharmacies(
+    day_of_week: Optional[str],
+    time_str: Optional[str],
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
     """
     List all pharmacies open at a specific time and on a day of week if requested.
-    e.g. GET /pharmacies/open?day_of_week=Thur&time_str=14:00
+    e.g. GET /pharmacies/open?day_of_week=Thur&time_str=14:00&fields=id,name
     若兩個參數都沒傳，回傳所有藥局。
+    支援 If-None-Match：所有藥局的版本都沒變時回 304。
     """
-    query = db.query(Pharmacy)
+    names = parse_fields(fields, PHARMACY_COLUMNS)
+    check_time = _parse_time(time_str) if day_of_week and time_str else None
+    etag = make_etag("pharmacies", current_version(db, prefix=PHARMACY_PREFIX), request)
+    not_modified = check_etag(request, response, etag)
+    if not_modified:
+        return not_modified
+
+    if names is None:
+        query = db.query(Pharmacy)
+    else:
+        # 篩選營業中需要 id，另外以 _id 帶出，不放進輸出
+        query = db.query(Pharmacy.id.label("_id"), *field_columns(names, PHARMACY_COLUMNS))
     pharmacies = query.all()
-    if not day_of_week or not time_str:
-        return pharmacies  # 無參數則全部
 
-    # 轉換 time_str -> time
-    hour_min = time_str.split(":")
-    check_time = time(int(hour_min[0]), int(hour_min[1]) if len(hour_min) > 1 else 0)
-
-    result = []
-    for ph in pharmacies:
-        ohs = ph.opening_hours
-        is_open = False
-        for oh in ohs:
-            if oh.day_of_week.value == day_of_week:
-                if is_open_now(oh.open_time, oh.close_time, check_time):
-                    is_open = True
-                    break
-        if is_open:
-            result.append(ph)
-    return result
+    if check_time is not None:
+        open_ids = _open_pharmacy_ids(db, day_of_week, check_time)
+        if names is None:
+            pharmacies = [ph for ph in pharmacies if ph.id in open_ids]
+        else:
+            pharmacies = [ph for ph in pharmacies if ph._id in open_ids]
+    # 無參數則全部
+
+    if names is None:
+        return pharmacies
+    return fields_response(rows_to_dicts(pharmacies, names), response)
+
+@router.get("/cheapest", response_model=List[MaskOffer])
+def list_cheapest_offers(
+    product_id: Optional[int] = None,
+    name: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    day_of_week: Optional[str] = None,
+    time_str: Optional[str] = None,
+    open_now: bool = False
+):
+    """
+    Price comparison: the cheapest pharmacies selling a mask product.
+    e.g. GET /pharmacies/cheapest?name=True Barrier (green) (3 per pack)&limit=5&open_now=true
+    e.g. GET /pharmacies/cheapest?product_id=3&day_of_week=Thur&time_str=14:00
+    商品以 product_id 或完整名稱指定；給 day_of_week + time_str (或 open_now) 時只列出當時營業中的藥局。
+    open_now 以 OPENING_HOURS_TZ 時區的現在時間判斷。
+    完全由記憶體內的 offer_index 回應，不查資料庫。
+    """
+    if not offer_index.built:
+        raise HTTPException(status_code=503, detail="Offer index is not ready")
+    if product_id is None:
+        if name is None:
+            raise HTTPException(status_code=400, detail="product_id or name is required")
+        product_id = product_catalog.get_id(name)
+        if product_id is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+
+    check_day, check_time = None, None
+    if open_now:
+        now = datetime.now(ZoneInfo(OPENING_HOURS_TZ))
+        check_day, check_time = list(DayOfWeekEnum)[now.weekday()].value, now.time()
+    elif day_of_week and time_str:
+        check_day, check_time = day_of_week, _parse_time(time_str)
+    return offer_index.cheapest(product_id, limit, check_day, check_time)
 
 @router.get("/{pharmacy_id}/masks", response_model=List[MaskSchema])
 def list_masks_of_pharmacy(
     pharmacy_id: int,
+    request: Request,
+    response: Response,
     sort_by: Optional[str] = None,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
     List all masks sold by a given pharmacy, sorted by mask name or price.
-    e.g. GET /pharmacies/5/masks?sort_by=price
+    e.g. GET /pharmacies/5/masks?sort_by=price&fields=name,price
+    支援 If-None-Match：該藥局的口罩版本沒變時回 304。
+    """
+    names = parse_fields(fields, MASK_COLUMNS)
+    etag = make_etag("pharmacy-masks", current_version(db, key=pharmacy_masks_key(pharmacy_id)), request)
+    not_modified = check_etag(request, response, etag)
+    if not_modified:
+        return not_modified
+
+    q = _mask_query(db, names, join_product=(sort_by == "name")).filter(Mask.pharmacy_id == pharmacy_id)
+    if sort_by == "name":
+        q = q.order_by(Product.name)
+    elif sort_by == "price":
+        q = q.order_by(Mask.price)
+    if names is None:
+        return q.all()
+    return fields_response(rows_to_dicts(q.all(), names), response)
+
+@router.get("/masks", response_model=Dict[int, List[MaskSchema]])
+def list_masks_of_pharmacies(
+    ids: str,
+    sort_by: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
     """
-    q = db.query(Mask).filter(Mask.pharmacy_id == pharmacy_id)
+    Batch version of /{pharmacy_id}/masks: masks of several pharmacies in one query.
+    e.g. GET /pharmacies/masks?ids=1,2,3&sort_by=price
+    回傳 {pharmacy_id: [masks...]}，每個藥局內的排序與 /{pharmacy_id}/masks 相同；
+    每個要求的 id 都會出現，不存在或沒有口罩的藥局為 []。
+    """
+    pharmacy_ids = parse_ids(ids, BATCH_MAX_IDS)
+    names = parse_fields(fields, MASK_COLUMNS)
+
+    q = _mask_query(db, names, join_product=(sort_by == "name"))
+    if names is not None:
+        # 分組需要 pharmacy_id，另外以 _pharmacy_id 帶出，不放進輸出
+        q = q.add_columns(Mask.pharmacy_id.label("_pharmacy_id"))
+    q = q.filter(Mask.pharmacy_id.in_(pharmacy_ids)).order_by(Mask.pharmacy_id)
     if sort_by == "name":
-        q = q.order_by(Mask.name)
+        q = q.order_by(Product.name)
     elif sort_by == "price":
         q = q.order_by(Mask.price)
-    return q.all()
+
+    grouped: Dict[int, list] = {ph_id: [] for ph_id in pharmacy_ids}
+    for row in q.all():
+        if names is None:
+            grouped[row.pharmacy_id].append(row)
+        else:
+            grouped[row._pharmacy_id].append({name: getattr(row, name) for name in names})
+    if names is None:
+        return grouped
+    return fields_response(grouped)
 
 @router.get("/filter", response_model=List[PharmacySchema])
 def filter_pharmacies_mask_count(
@@ -93,8 +243,12 @@ def filter_pharmacies_mask_count(
 
 
 @router.get("/all_masks", response_model=List[MaskSchema])
-def list_all_masks(db: Session = Depends(get_db)):
+def list_all_masks(fields: Optional[str] = None, db: Session = Depends(get_db)):
     """
     撈全部藥局的口罩 (即 masks 表內所有資料)
+    e.g. GET /pharmacies/all_masks?fields=pharmacy_id,name,price
     """
-    return db.query(Mask).all()
\ No newline at end of file
+    names = parse_fields(fields, MASK_COLUMNS)
+    if names is None:
+        return db.query(Mask).all()
+    return fields_response(rows_to_dicts(_mask_query(db, names).all(), names))
\ No newline at end of file
@@ -1,24 +1,47 @@
 # app/routers/search.py
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from app.database import get_db
-from app.models import Pharmacy, Mask
+from app.models import Pharmacy, Mask, Product
+from app.schemas import SearchResult
+from app.utils.fields import fields_response, parse_fields
+from app.utils.prefix_index import suggest_index
+from app.utils.product_catalog import product_catalog
+from app.utils.profiling import ProfiledRoute
 
-router = APIRouter(prefix="/search", tags=["Search"])
+router = APIRouter(prefix="/search", tags=["Search"], route_class=ProfiledRoute)
 
-@router.get("/")
-def search_pharmacies_and_masks(q: str, db: Session = Depends(get_db)):
+SEARCH_FIELDS = list(SearchResult.__fields__)
+
+@router.get("/", response_model=List[SearchResult])
+def search_pharmacies_and_masks(q: str, fields: Optional[str] = None, db: Session = Depends(get_db)):
     """
     Search for pharmacies or masks by name, ranked by 'relevance'.
     這裡以非常簡單的做法: 先查 pharmacy，再查 mask，
     然後按照 name 長度 or match 位置去做簡易排序 (僅示範)。
+    藥局與口罩都以 SearchResult 的欄位輸出，不適用的欄位為 null。
+    e.g. GET /search/?q=green&fields=type,name,price
     """
-    # 1) 查 pharmacies
-    phar_results = db.query(Pharmacy).filter(Pharmacy.name.ilike(f"%{q}%")).all()
+    names = parse_fields(fields, SEARCH_FIELDS)
+    wanted = set(names or SEARCH_FIELDS)
+
+    # 1) 查 pharmacies (只有要輸出 cash_balance 時才查)
+    phar_cols = [Pharmacy.id, Pharmacy.name]
+    if "cash_balance" in wanted:
+        phar_cols.append(Pharmacy.cash_balance)
+    phar_results = db.query(*phar_cols).filter(Pharmacy.name.ilike(f"%{q}%")).all()
 
-    # 2) 查 masks
-    mask_results = db.query(Mask).filter(Mask.name.ilike(f"%{q}%")).all()
+    # 2) 查 masks: 先在記憶體內的商品字典比對名稱，再以 product_id 查；名稱直接取自字典
+    #    字典沒有符合的 (warm-up 尚未完成 / 失敗、或字典還沒載入新商品) 時改查 products
+    product_names = {pid: product_catalog.get_name(pid) for pid in product_catalog.match(q)}
+    if not product_names:
+        product_names = dict(db.query(Product.id, Product.name).filter(Product.name.ilike(f"%{q}%")).all())
+    mask_cols = [Mask.id, Mask.pharmacy_id, Mask.product_id]
+    if "price" in wanted:
+        mask_cols.append(Mask.price)
+    mask_results = (db.query(*mask_cols).filter(Mask.product_id.in_(list(product_names))).all()
+                    if product_names else [])
 
     # 建立一個合併清單
     # 注意: "rank" 這裡只是示範，以 name.index(...) 來衡量簡易關聯度
@@ -35,28 +58,43 @@ def search_pharmacies_and_masks(q: str, db: Session = Depends(get_db)):
         combined.append({
             "type": "pharmacy",
             "pharmacy_id": p.id,
+            "mask_id": None,
             "name": p.name,
-            "cash_balance": p.cash_balance,
+            "price": None,
+            "cash_balance": getattr(p, "cash_balance", None),
             "rank": rank_score
         })
 
     for m in mask_results:
+        mask_name = product_names.get(m.product_id) or ""
         rank_score = 0
         try:
-            idx = m.name.lower().index(q.lower())
+            idx = mask_name.lower().index(q.lower())
             rank_score = 100 - idx
         except ValueError:
             pass
         combined.append({
             "type": "mask",
-            "mask_id": m.id,
             "pharmacy_id": m.pharmacy_id,
-            "name": m.name,
-            "price": m.price,
+            "mask_id": m.id,
+            "name": mask_name,
+            "price": getattr(m, "price", None),
+            "cash_balance": None,
             "rank": rank_score
         })
 
     # 依 rank_score desc 排序
     combined.sort(key=lambda x: x["rank"], reverse=True)
 
-    return combined
+    if names is None:
+        return combined
+    return fields_response([{name: row[name] for name in names} for row in combined])
+
+@router.get("/suggest")
+def suggest_pharmacies_and_masks(q: str, limit: int = Query(10, ge=1, le=50)):
+    """
+    Type-ahead suggestions for pharmacy and mask names.
+    e.g. GET /search/suggest?q=mask&limit=5
+    使用記憶體內的前綴索引 (不區分大小寫，依購買次數排序)，不查資料庫。
+    """
+    return suggest_index.suggest(q, limit)
@@ -1,10 +1,11 @@
 # app/routers/users.py
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List, Optional
 from datetime import datetime
+from app.config import BATCH_MAX_IDS
 from app.database import get_db
-from app.models import User, Pharmacy, Mask, PurchaseHistory
+from app.models import User, Pharmacy, Mask, Product, PurchaseHistory
 from app.schemas import (
     User as UserSchema,
     PurchaseHistory as PurchaseHistorySchema,
@@ -12,19 +13,97 @@ from app.schemas import (
     TopSpendersResponse,
     TransactionSummary
 )
+from app.utils.fields import field_columns, fields_response, parse_fields, parse_ids, rows_to_dicts
+from app.utils.product_catalog import product_catalog
+from app.utils.purchase_snapshot import get_snapshot
+from app.utils.versioning import (
+    bump_versions, check_etag, current_version, make_etag, user_purchases_key
+)
+from app.utils.profiling import ProfiledRoute
+
+router = APIRouter(prefix="/users", tags=["Users"], route_class=ProfiledRoute)
 
-router = APIRouter(prefix="/users", tags=["Users"])
+# ?fields= 可選的欄位 -> SQL 欄位
+PURCHASE_COLUMNS = {
+    "id": PurchaseHistory.id,
+    "user_id": PurchaseHistory.user_id,
+    "pharmacy_id": PurchaseHistory.pharmacy_id,
+    "mask_id": PurchaseHistory.mask_id,
+    "product_id": PurchaseHistory.product_id,
+    "mask_name": Product.name,
+    "quantity": PurchaseHistory.quantity,
+    "transaction_amount": PurchaseHistory.transaction_amount,
+    "transaction_date": PurchaseHistory.transaction_date,
+}
 
 @router.get("/", response_model=List[UserSchema])
 def list_users(db: Session = Depends(get_db)):
     return db.query(User).all()
 
+@router.get("/purchases", response_model=Dict[int, List[PurchaseHistorySchema]])
+def get_users_purchases(ids: str, fields: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Batch version of /{user_id}/purchases: purchase histories of several users in one query.
+    e.g. GET /users/purchases?ids=1,2,3&fields=mask_name,transaction_amount
+    回傳 {user_id: [purchases...]}，與 /pharmacies/masks 相同，每個要求的 id 都會出現，
+    不存在或沒有購買紀錄的使用者為 [] (不另外查 users 表)。
+    """
+    user_ids = parse_ids(ids, BATCH_MAX_IDS)
+    names = parse_fields(fields, PURCHASE_COLUMNS)
+
+    grouped: Dict[int, list] = {uid: [] for uid in user_ids}
+    if names is None:
+        q = db.query(PurchaseHistory)
+    else:
+        # 分組需要 user_id，另外以 _user_id 帶出，不放進輸出
+        q = (db.query(PurchaseHistory.user_id.label("_user_id"), *field_columns(names, PURCHASE_COLUMNS))
+             .select_from(PurchaseHistory))
+        if "mask_name" in names:
+            q = q.outerjoin(PurchaseHistory.product)
+    q = q.filter(PurchaseHistory.user_id.in_(list(grouped))).order_by(PurchaseHistory.user_id)
+
+    for row in q.all():
+        if names is None:
+            grouped[row.user_id].append(row)
+        else:
+            grouped[row._user_id].append({name: getattr(row, name) for name in names})
+    if names is None:
+        return grouped
+    return fields_response(grouped)
+
 @router.get("/{user_id}/purchases", response_model=List[PurchaseHistorySchema])
-def get_user_purchases(user_id: int, db: Session = Depends(get_db)):
+def get_user_purchases(
+    user_id: int,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    e.g. GET /users/7/purchases?fields=mask_name,transaction_amount,transaction_date
+    支援 If-None-Match：使用者沒有新的購買紀錄時回 304。
+    """
+    names = parse_fields(fields, PURCHASE_COLUMNS)
+    etag = make_etag("user-purchases", current_version(db, key=user_purchases_key(user_id)), request)
+    not_modified = check_etag(
+        request, response, etag,
+        exists=lambda: db.query(User.id).filter(User.id == user_id).first() is not None
+    )
+    if not_modified:
+        return not_modified
+
     u = db.query(User).filter(User.id == user_id).first()
     if not u:
         raise HTTPException(status_code=404, detail="User not found")
-    return u.purchase_histories
+    if names is None:
+        return u.purchase_histories
+
+    q = (db.query(*field_columns(names, PURCHASE_COLUMNS))
+         .select_from(PurchaseHistory)
+         .filter(PurchaseHistory.user_id == user_id))
+    if "mask_name" in names:
+        q = q.outerjoin(PurchaseHistory.product)
+    return fields_response(rows_to_dicts(q.all(), names), response)
 
 @router.post("/{user_id}/purchase")
 def purchase_masks(
@@ -58,6 +137,7 @@ def purchase_masks(
     2. 增加 pharmacy.cash_balance
     3. 新增 purchase_histories
     4. 如果任何一筆購買失敗，全部回滾(atomic)
+    5. 遞增使用者購買紀錄的版本號 (ETag)；藥局 cash_balance 的版本由 pharmacies 觸發器遞增
     """
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
@@ -77,11 +157,18 @@ def purchase_masks(
             if not pharmacy:
                 raise HTTPException(status_code=404, detail=f"Pharmacy id={item.pharmacy_id} not found")
 
-            # 若有 mask_id，檢查是否存在
+            # 若有 mask_id，檢查是否存在；商品以 mask 為準，否則用 mask_name 查商品字典
+            # (不認得的名稱與不存在的 mask_id 一樣回 404，不會新增商品)
+            product_id = None
             if item.mask_id:
                 m = db.query(Mask).filter(Mask.id == item.mask_id, Mask.pharmacy_id == pharmacy.id).first()
                 if not m:
                     raise HTTPException(status_code=404, detail=f"Mask id={item.mask_id} not found in pharmacy {item.pharmacy_id}")
+                product_id = m.product_id
+            elif item.mask_name:
+                product_id = product_catalog.lookup(db, item.mask_name)
+                if product_id is None:
+                    raise HTTPException(status_code=404, detail=f"Mask product '{item.mask_name}' not found")
 
             # 核銷餘額
             user.cash_balance -= item.transaction_amount
@@ -92,13 +179,14 @@ def purchase_masks(
                 user_id=user.id,
                 pharmacy_id=pharmacy.id,
                 mask_id=item.mask_id,
-                mask_name=item.mask_name,
+                product_id=product_id,
                 quantity=item.quantity,
                 transaction_amount=item.transaction_amount,
                 transaction_date=item.transaction_date
             )
             db.add(new_record)
 
+        bump_versions(db, [user_purchases_key(user.id)])
         db.commit()
         db.refresh(user)
         # 也可 refresh 所有 pharmacy, new_record ...
@@ -118,7 +206,13 @@ def top_spenders(start_date: datetime, end_date: datetime, top_x: int, db: Sessi
     """
     The top x users by total transaction amount of masks within a date range.
     e.g. GET /users/top_spenders?start_date=2021-01-01T00:00:00&end_date=2021-01-31T23:59:59&top_x=5
+    若欄式快照已涵蓋此區間且仍是最新 (匯出後沒有新增該區間的紀錄、ETL 未重新匯入)，
+    直接在快照上計算；否則查資料庫。
     """
+    snapshot = get_snapshot()
+    if snapshot is not None and snapshot.covers(end_date):
+        return [TopSpendersResponse(**row) for row in snapshot.top_spenders(start_date, end_date, top_x)]
+
     from sqlalchemy import func
     res = (db.query(
                 PurchaseHistory.user_id,
@@ -148,7 +242,14 @@ def transaction_summary(start_date: datetime, end_date: datetime, db: Session =
     The total amount of masks and dollar value of transactions within a date range.
     - total_masks = sum of quantity
     - total_dollar = sum of transaction_amount
+    若欄式快照已涵蓋此區間且仍是最新 (匯出後沒有新增該區間的紀錄、ETL 未重新匯入)，
+    直接在快照上計算；否則查資料庫。
     """
+    snapshot = get_snapshot()
+    if snapshot is not None and snapshot.covers(end_date):
+        total_masks, total_dollar = snapshot.transaction_summary(start_date, end_date)
+        return TransactionSummary(total_masks=total_masks, total_dollar=total_dollar)
+
     from sqlalchemy import func
     row = (db.query(
                func.sum(PurchaseHistory.quantity).label("total_masks"),
@@ -42,9 +42,17 @@ class MaskBase(BaseModel):
 class Mask(MaskBase):
     id: int
     pharmacy_id: int
+    product_id: int
     class Config:
         orm_mode = True
 
+class MaskOffer(BaseModel):
+    mask_id: int
+    pharmacy_id: int
+    pharmacy_name: str
+    product_id: int
+    price: float
+
 # ---- User & PurchaseHistory ----
 class UserBase(BaseModel):
     name: str
@@ -66,6 +74,7 @@ class PurchaseHistoryBase(BaseModel):
 class PurchaseHistory(PurchaseHistoryBase):
     id: int
     user_id: int
+    product_id: Optional[int] = None
     class Config:
         orm_mode = True
 
@@ -82,3 +91,12 @@ class TopSpendersResponse(BaseModel):
 class TransactionSummary(BaseModel):
     total_masks: int
     total_dollar: float
+
+class SearchResult(BaseModel):
+    type: str  # "pharmacy" or "mask"
+    pharmacy_id: int
+    mask_id: Optional[int] = None
+    name: str
+    price: Optional[float] = None
+    cash_balance: Optional[float] = None
+    rank: int
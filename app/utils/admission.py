@@ -0,0 +1,140 @@
+# app/utils/admission.py
+"""
+依路由類別做 admission control / load shedding。
+
+每個類別 (writes / catalog / analytics) 有自己的同時處理上限與有限長度的等待佇列：
+- 有空位 => 直接處理
+- 沒空位但佇列未滿 => 排隊，最多等 queue_timeout 秒
+- 佇列已滿或等待逾時 => 立即回 503 + Retry-After
+
+類別之間互不影響，分析類請求塞車時不會吃掉 purchase_masks 的名額。
+"""
+import asyncio
+import json
+from typing import Dict, Optional
+
+from app.config import ADMISSION_LIMITS, ADMISSION_QUEUE_TIMEOUT
+
+# 不受限制的路徑 (健康檢查、文件、統計本身，以及不使用 DB 連線的 suggest / 比價)
+EXEMPT_PREFIXES = (
+    "/docs", "/redoc", "/openapi.json", "/metrics", "/ready", "/search/suggest", "/pharmacies/cheapest"
+)
+ANALYTICS_PREFIXES = ("/users/top_spenders", "/users/transactions", "/search")
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """回傳路由類別，None 代表不做 admission control"""
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    if method not in READ_METHODS:
+        return "writes"
+    if path.startswith(ANALYTICS_PREFIXES):
+        return "analytics"
+    return "catalog"
+
+
+class AdmissionGate:
+    """單一路由類別的同時數上限 + 等待佇列"""
+
+    def __init__(self, name: str, limit: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # 延後到 event loop 啟動後才建立
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def acquire(self) -> bool:
+        sem = self.semaphore
+        if not sem.locked():
+            await sem.acquire()
+        elif self.waiting >= self.queue_size:
+            self.rejected += 1
+            return False
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(sem.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                self.rejected += 1
+                return False
+            finally:
+                self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        self.active -= 1
+        self.semaphore.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware: 依 classify() 的結果把請求交給對應的 AdmissionGate"""
+
+    def __init__(self, app, gates: Dict[str, AdmissionGate], retry_after: int):
+        self.app = app
+        self.gates = gates
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = classify(scope["method"], scope["path"])
+        gate = self.gates.get(name) if name else None
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await gate.acquire():
+            await self._reject(gate, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+    async def _reject(self, gate: AdmissionGate, send):
+        body = json.dumps({"detail": f"Server busy ({gate.name}), retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def build_gates() -> Dict[str, AdmissionGate]:
+    return {
+        name: AdmissionGate(name, limit, queue_size, ADMISSION_QUEUE_TIMEOUT)
+        for name, (limit, queue_size) in ADMISSION_LIMITS.items()
+    }
@@ -0,0 +1,115 @@
+# app/utils/compression.py
+"""
+依 Accept-Encoding 協商的回應壓縮 (br 優先，其次 gzip)。
+
+- 只壓縮 JSON / 文字，且 body >= minimum_size 的回應
+- 壓縮後的 strong ETag 加上 "-br" / "-gzip" 後綴 (不同編碼是不同表示)，
+  versioning 比對 If-None-Match 時會去掉後綴，304 則原樣帶回客戶端送來的 (含後綴的) ETag
+"""
+import gzip
+from typing import List, Optional, Tuple
+
+import brotli
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+ETAG_SUFFIXES = ("-br", "-gzip")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """解析 Accept-Encoding (含 q 值)，回傳 "br" / "gzip" / None"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if token:
+            accepted[token.strip().lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    candidates = ["br", "gzip"]
+    best, best_q = None, 0.0
+    for enc in candidates:
+        q = accepted.get(enc, wildcard)
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+def _compress(body: bytes, encoding: str, gzip_level: int, brotli_quality: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level)
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for k, v in headers:
+        if k.lower() == name:
+            return v
+    return None
+
+
+class CompressionMiddleware:
+    """ASGI middleware：一次性 (非 streaming) 的回應才壓縮"""
+
+    def __init__(self, app, minimum_size: int, gzip_level: int, brotli_quality: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = _header(scope.get("headers", []), b"accept-encoding")
+        encoding = choose_encoding(accept.decode("latin-1")) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            # http.response.body
+            body = message.get("body", b"")
+            headers = list(start_message.get("headers", []))
+            content_type = _header(headers, b"content-type") or b""
+            if (message.get("more_body", False)
+                    or len(body) < self.minimum_size
+                    or _header(headers, b"content-encoding") is not None
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = _compress(body, encoding, self.gzip_level, self.brotli_quality)
+            new_headers = []
+            for k, v in headers:
+                lk = k.lower()
+                if lk == b"content-length":
+                    continue
+                if lk == b"etag" and v.endswith(b'"') and not v.startswith(b"W/"):
+                    v = v[:-1] + f"-{encoding}".encode() + b'"'
+                new_headers.append((k, v))
+            new_headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            await send({**start_message, "headers": new_headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
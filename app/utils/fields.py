@@ -0,0 +1,59 @@
+# app/utils/fields.py
+"""
+Sparse fieldsets：?fields=id,name,price
+
+只查詢、只輸出客戶端要的欄位。路由提供「欄位名稱 -> SQL 欄位」的對照表，
+parse_fields() 驗證參數，field_columns() 產生 db.query(...) 用的欄位清單，
+fields_response() 把查詢結果直接輸出成 JSON (不經過完整的 response_model)。
+
+批次查詢的 ?ids=1,2,3 也在這裡解析 (parse_ids)。
+"""
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[List[str]]:
+    """None = 沒有指定 (輸出全部欄位)；有不認得的欄位回 400"""
+    if fields is None:
+        return None
+    names = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    allowed = list(allowed)
+    unknown = [f for f in names if f not in allowed]
+    if unknown or not names:
+        raise HTTPException(
+            status_code=400,
+            detail=f"fields must be a comma-separated subset of: {', '.join(allowed)}"
+        )
+    return names
+
+
+def parse_ids(ids: str, max_ids: int) -> List[int]:
+    """解析 ?ids=1,2,3 (去重、保留順序)，格式錯誤或超過 max_ids 個回 400"""
+    try:
+        parsed = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if not parsed:
+        raise HTTPException(status_code=400, detail="ids must not be empty")
+    if len(parsed) > max_ids:
+        raise HTTPException(status_code=400, detail=f"At most {max_ids} ids per request")
+    return parsed
+
+
+def field_columns(names: List[str], columns: Dict[str, object]) -> list:
+    return [columns[name].label(name) for name in names]
+
+
+def rows_to_dicts(rows, names: List[str]) -> List[Dict]:
+    return [{name: getattr(row, name) for name in names} for row in rows]
+
+
+def fields_response(content, response: Optional[Response] = None) -> JSONResponse:
+    """直接回傳 JSONResponse；保留路由已經設定在 response 上的 header (例如 ETag)"""
+    headers = dict(response.headers) if response is not None else None
+    if headers:
+        headers.pop("content-length", None)
+    return JSONResponse(content=jsonable_encoder(content), headers=headers)
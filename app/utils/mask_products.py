@@ -0,0 +1,76 @@
+# app/utils/mask_products.py
+"""
+masks.name -> products 正規化的就地轉換 (baseline 建的資料庫)。
+
+baseline 的 masks 直接存商品名稱，現在改成 masks.product_id 指向 products。
+create_all 只會建出空的 products 表，不會改動既有的 masks，所以由 migrate_mask_products()：
+
+- 以 DISTINCT masks.name (以及舊版 purchase_histories.mask_name) 建立 products，
+  品牌 / 顏色 / 包裝數以 parse_product_name 解析
+- 新增 masks.product_id 並依名稱回填，補上 NOT NULL 與索引
+- 刪除 masks.name
+
+必須在 purchase_histories 轉換 (partitions.migrate_unpartitioned) 之前執行，
+舊購買紀錄的 mask_name 才對得到 products.id。
+
+這裡只依賴標準函式庫，函式吃 DB-API cursor，與 app/utils/partitions.py 相同。
+"""
+from typing import Optional
+
+from app.utils.product_name import parse_product_name
+
+# etl.py 與轉換共用
+PRODUCTS_DDL = """
+CREATE TABLE IF NOT EXISTS products (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE,
+    brand VARCHAR(255) NOT NULL,
+    color VARCHAR(64),
+    pack_size INT
+);
+"""
+
+
+def _has_column(cursor, table: str, column: str) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s",
+        (table, column),
+    )
+    return cursor.fetchone() is not None
+
+
+def migrate_mask_products(cursor) -> Optional[int]:
+    """
+    masks 若還有 name 欄位就轉成 product_id，回傳 products 新增的筆數；已轉換過 (或沒有 masks) 回傳 None。
+    呼叫端負責 DDL advisory lock 與 commit，失敗會整個 rollback。
+    """
+    if not _has_column(cursor, "masks", "name"):
+        return None
+
+    cursor.execute("LOCK TABLE masks IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(PRODUCTS_DDL)
+
+    cursor.execute("SELECT DISTINCT name FROM masks WHERE name IS NOT NULL")
+    names = {name for (name,) in cursor.fetchall()}
+    # 已下架商品只留在購買紀錄裡，也要有 product 才不會在轉換時變成 NULL
+    if _has_column(cursor, "purchase_histories", "mask_name"):
+        cursor.execute("SELECT DISTINCT mask_name FROM purchase_histories WHERE mask_name IS NOT NULL")
+        names.update(name for (name,) in cursor.fetchall())
+
+    created = 0
+    for name in sorted(names):
+        brand, color, pack_size = parse_product_name(name)
+        cursor.execute(
+            "INSERT INTO products (name, brand, color, pack_size) VALUES (%s, %s, %s, %s) "
+            "ON CONFLICT (name) DO NOTHING",
+            (name, brand, color, pack_size),
+        )
+        created += cursor.rowcount
+
+    cursor.execute("ALTER TABLE masks ADD COLUMN IF NOT EXISTS product_id INT REFERENCES products(id)")
+    cursor.execute("UPDATE masks m SET product_id = p.id FROM products p WHERE p.name = m.name")
+    cursor.execute("ALTER TABLE masks ALTER COLUMN product_id SET NOT NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_masks_product_id ON masks (product_id)")
+    cursor.execute("ALTER TABLE masks DROP COLUMN name")
+    return created
@@ -0,0 +1,115 @@
+# app/utils/offer_index.py
+"""
+跨藥局比價用的記憶體內索引：每個商品 (product_id) 一份依價格排序的販售清單。
+
+- 最便宜的 k 筆：從排序清單開頭往後取，需要「營業中」時略過沒開的藥局，
+  取滿 k 筆就停，不必掃整張 masks 表
+- 營業時間、藥局名稱一起載入記憶體，查詢完全不碰資料庫
+- refresh() 先比對 pharmacy_masks:* / pharmacy_hours:* 的版本 (含 ETL 重設的 epoch)，
+  價格 / 品項 / 營業時間有變才整份重建，重建完成後整組替換，讀取端不需要加鎖；
+  pharmacy:* 有變 (改名、新增藥局；每次購買的 cash_balance 也會) 只重讀藥局名稱，
+  不重建 offers；版本由資料庫觸發器遞增 (app/utils/version_triggers.py)，app 外的修改也會反映
+"""
+import threading
+from datetime import time
+from itertools import groupby
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models import Mask, Pharmacy, PharmacyOpeningHours
+from app.utils.time_helper import is_open_now
+from app.utils.versioning import (
+    PHARMACY_HOURS_PREFIX, PHARMACY_MASKS_PREFIX, PHARMACY_PREFIX, current_version
+)
+
+
+class Offer(NamedTuple):
+    price: float
+    mask_id: int
+    pharmacy_id: int
+
+
+# pharmacy_id -> day_of_week -> [(open_time, close_time), ...]
+OpeningHours = Dict[int, Dict[str, List[Tuple[time, time]]]]
+
+
+def _is_open(hours: OpeningHours, pharmacy_id: int, day_of_week: str, check_time: time) -> bool:
+    return any(is_open_now(open_t, close_t, check_time)
+               for open_t, close_t in hours.get(pharmacy_id, {}).get(day_of_week, ()))
+
+
+class OfferIndex:
+    def __init__(self):
+        # (product_id -> 依價格排序的 offers, 營業時間, 藥局名稱)，整組替換
+        self._state: Tuple[Dict[int, List[Offer]], OpeningHours, Dict[int, str]] = ({}, {}, {})
+        self.version: Optional[str] = None
+        self.names_version: Optional[str] = None
+        self.built = False
+        self._refresh_lock = threading.Lock()
+
+    def cheapest(
+        self,
+        product_id: int,
+        limit: int,
+        day_of_week: Optional[str] = None,
+        check_time: Optional[time] = None,
+    ) -> List[Dict]:
+        """最便宜的 limit 筆 (同價依 mask_id)；有給 day_of_week + check_time 時只取營業中的藥局"""
+        offers, hours, names = self._state
+        only_open = day_of_week is not None and check_time is not None
+        result = []
+        for offer in offers.get(product_id, ()):
+            if len(result) >= limit:
+                break
+            if only_open and not _is_open(hours, offer.pharmacy_id, day_of_week, check_time):
+                continue
+            result.append({
+                "mask_id": offer.mask_id,
+                "pharmacy_id": offer.pharmacy_id,
+                "pharmacy_name": names.get(offer.pharmacy_id, ""),
+                "product_id": product_id,
+                "price": offer.price,
+            })
+        return result
+
+    def refresh(self, db: Session) -> bool:
+        """版本有變 (或還沒建過) 才重建；回傳是否重建 (只重讀藥局名稱不算)"""
+        with self._refresh_lock:
+            version = "/".join(current_version(db, prefix=prefix)
+                               for prefix in (PHARMACY_MASKS_PREFIX, PHARMACY_HOURS_PREFIX))
+            names_version = current_version(db, prefix=PHARMACY_PREFIX)
+            if self.built and version == self.version:
+                if names_version != self.names_version:
+                    offers, hours, _ = self._state
+                    self._state = (offers, hours, dict(db.query(Pharmacy.id, Pharmacy.name).all()))
+                    self.names_version = names_version
+                return False
+
+            rows = (db.query(Mask.product_id, Mask.price, Mask.id, Mask.pharmacy_id)
+                    .order_by(Mask.product_id, Mask.price, Mask.id)
+                    .all())
+            offers = {
+                product_id: [Offer(price, mask_id, ph_id) for _, price, mask_id, ph_id in group]
+                for product_id, group in groupby(rows, key=lambda r: r[0])
+            }
+
+            hours: OpeningHours = {}
+            for ph_id, dow, open_t, close_t in db.query(
+                PharmacyOpeningHours.pharmacy_id,
+                PharmacyOpeningHours.day_of_week,
+                PharmacyOpeningHours.open_time,
+                PharmacyOpeningHours.close_time,
+            ):
+                hours.setdefault(ph_id, {}).setdefault(dow.value, []).append((open_t, close_t))
+
+            names = dict(db.query(Pharmacy.id, Pharmacy.name).all())
+
+            self._state = (offers, hours, names)
+            self.version = version
+            self.names_version = names_version
+            self.built = True
+            return True
+
+
+offer_index = OfferIndex()
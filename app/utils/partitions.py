@@ -0,0 +1,297 @@
+# app/utils/partitions.py
+"""
+purchase_histories 依 transaction_date 以「月」做 RANGE partition。
+
+- 每個月一張 partition: purchase_histories_YYYYMM，範圍 [當月 1 號, 下月 1 號)
+- purchase_histories_default 接住尚未建立 partition 的月份
+- 保留期限外的 partition 只 DETACH (變成獨立資料表，可另行封存)，不直接刪除
+- 既有的非 partition 版 purchase_histories (baseline 建的) 由 migrate_unpartitioned()
+  轉換：舊表改名為 purchase_histories_legacy 保留，資料複製進新的 partitioned table
+  (之前先由 app/utils/mask_products.py 把 masks.name 轉成 products)
+
+這裡只依賴標準函式庫，函式都吃 DB-API cursor，etl.py (psycopg2) 與 app (SQLAlchemy) 共用。
+
+    python -m app.utils.partitions     # 建立未來月份 partition、執行保留期限 (可放 cron)
+"""
+import re
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Union
+
+from app.utils.mask_products import migrate_mask_products
+
+PARENT_TABLE = "purchase_histories"
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+LEGACY_TABLE = f"{PARENT_TABLE}_legacy"
+# 多個 worker 同時啟動時以 advisory lock 序列化 DDL (pg_advisory_xact_lock 的 key)
+DDL_LOCK_KEY = 0x6B64616E
+_PARTITION_RE = re.compile(rf"^{PARENT_TABLE}_(\d{{4}})(\d{{2}})$")
+
+# partitioned 的 purchase_histories (etl.py 與 migrate_unpartitioned 共用)
+# partition key 必須包含在主鍵內，所以主鍵是 (id, transaction_date)
+PARENT_DDL = f"""
+CREATE TABLE IF NOT EXISTS {PARENT_TABLE} (
+    id SERIAL,
+    user_id INT NOT NULL,
+    pharmacy_id INT NOT NULL,
+    mask_id INT,
+    product_id INT,
+    quantity INT DEFAULT 1,
+    transaction_amount DOUBLE PRECISION DEFAULT 0,
+    transaction_date TIMESTAMP NOT NULL,
+    PRIMARY KEY (id, transaction_date),
+    CONSTRAINT fk_user
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        ON DELETE CASCADE,
+    CONSTRAINT fk_pharmacy
+        FOREIGN KEY (pharmacy_id) REFERENCES pharmacies(id)
+        ON DELETE CASCADE,
+    CONSTRAINT fk_mask
+        FOREIGN KEY (mask_id) REFERENCES masks(id)
+        ON DELETE CASCADE,
+    CONSTRAINT fk_product
+        FOREIGN KEY (product_id) REFERENCES products(id)
+) PARTITION BY RANGE (transaction_date);
+CREATE INDEX IF NOT EXISTS ix_{PARENT_TABLE}_transaction_date
+    ON {PARENT_TABLE} (transaction_date);
+CREATE INDEX IF NOT EXISTS ix_{PARENT_TABLE}_user_id
+    ON {PARENT_TABLE} (user_id);
+"""
+
+
+def month_start(d: Union[date, datetime]) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, n: int) -> date:
+    y, m = divmod(d.month - 1 + n, 12)
+    return date(d.year + y, m + 1, 1)
+
+
+def partition_name(d: Union[date, datetime]) -> str:
+    """某個時間點所屬的 partition 名稱，ETL 用來直接寫入對應的 partition"""
+    return f"{PARENT_TABLE}_{d.year:04d}{d.month:02d}"
+
+
+def lock_ddl(cursor) -> None:
+    """取得交易層級的 advisory lock，commit / rollback 時自動釋放"""
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (DDL_LOCK_KEY,))
+
+
+def create_default_partition(cursor) -> None:
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"
+    )
+
+
+def ensure_month_partition(cursor, month: date) -> bool:
+    """
+    建立 month 所屬的 partition，已存在則略過。回傳是否新建。
+    若 default partition 已有落在該月的資料，會一併搬過去再 ATTACH，
+    否則 PostgreSQL 會拒絕建立重疊範圍的 partition。
+    """
+    name = partition_name(month)
+    cursor.execute("SELECT to_regclass(%s)", (name,))
+    if cursor.fetchone()[0] is not None:
+        return False
+
+    lo, hi = month_start(month), add_months(month_start(month), 1)
+    cursor.execute(
+        f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    )
+    cursor.execute("SELECT to_regclass(%s)", (DEFAULT_PARTITION,))
+    if cursor.fetchone()[0] is not None:
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE transaction_date >= %s AND transaction_date < %s
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+            """,
+            (lo, hi),
+        )
+    cursor.execute(
+        f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"
+    )
+    return True
+
+
+def ensure_partitions(cursor, months: Iterable[date]) -> int:
+    """依序建立多個月份的 partition，回傳新建數量"""
+    created = 0
+    for month in sorted(set(month_start(m) for m in months)):
+        if ensure_month_partition(cursor, month):
+            created += 1
+    return created
+
+
+def migrate_unpartitioned(cursor) -> Optional[int]:
+    """
+    purchase_histories 若還是一般資料表 (baseline 版本)，轉成 partitioned table。
+    回傳複製的筆數；已經是 partitioned (或不存在) 時回傳 None。
+
+    - 舊表改名為 purchase_histories_legacy 保留不刪，連同主鍵 / 索引 / sequence 一起改名避免撞名
+    - 舊表若還是 mask_name 欄位 (products 正規化之前)，依名稱對應 products.id，對不到的為 NULL
+    - transaction_date 為 NULL 的紀錄無法放進任何 partition，只留在舊表
+    整個轉換在呼叫端的交易內完成，失敗會整個 rollback。
+    """
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (PARENT_TABLE,))
+    row = cursor.fetchone()
+    if row is None or row[0] == "p":
+        return None
+
+    cursor.execute(f"LOCK TABLE {PARENT_TABLE} IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(f"ALTER TABLE {PARENT_TABLE} RENAME TO {LEGACY_TABLE}")
+    # 主鍵 / unique 的索引名稱與新表相同，先改名 (RENAME CONSTRAINT 會一併改索引名稱)
+    cursor.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'u')",
+        (LEGACY_TABLE,),
+    )
+    for (conname,) in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT "{conname}" TO "{conname}_legacy"')
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = to_regclass(%s) AND NOT i.indisprimary AND NOT i.indisunique
+        """,
+        (LEGACY_TABLE,),
+    )
+    for (index_name,) in cursor.fetchall():
+        cursor.execute(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_legacy"')
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", (LEGACY_TABLE,))
+    seq = cursor.fetchone()[0]
+    if seq is not None:
+        cursor.execute(f"ALTER SEQUENCE {seq} RENAME TO {LEGACY_TABLE}_id_seq")
+
+    cursor.execute(PARENT_DDL)
+    create_default_partition(cursor)
+    cursor.execute(
+        f"SELECT DISTINCT date_trunc('month', transaction_date) FROM {LEGACY_TABLE} "
+        f"WHERE transaction_date IS NOT NULL"
+    )
+    ensure_partitions(cursor, [m for (m,) in cursor.fetchall()])
+
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = %s",
+        (LEGACY_TABLE,),
+    )
+    legacy_columns = {name for (name,) in cursor.fetchall()}
+    if "product_id" in legacy_columns:
+        product_expr = "l.product_id"
+    elif "mask_name" in legacy_columns:
+        product_expr = "(SELECT p.id FROM products p WHERE p.name = l.mask_name)"
+    else:
+        product_expr = "NULL"
+    cursor.execute(
+        f"""
+        INSERT INTO {PARENT_TABLE}
+            (id, user_id, pharmacy_id, mask_id, product_id, quantity, transaction_amount, transaction_date)
+        SELECT l.id, l.user_id, l.pharmacy_id, l.mask_id, {product_expr},
+               l.quantity, l.transaction_amount, l.transaction_date
+        FROM {LEGACY_TABLE} l
+        WHERE l.transaction_date IS NOT NULL
+        """
+    )
+    copied = cursor.rowcount
+    # 新表的 sequence 從舊資料最大 id 之後開始
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+        f"COALESCE((SELECT max(id) FROM {PARENT_TABLE}), 0) + 1, false)",
+        (PARENT_TABLE,),
+    )
+    return copied
+
+
+def list_month_partitions(cursor) -> List[date]:
+    """目前掛在 purchase_histories 底下的月份 partition (不含 default)"""
+    cursor.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = %s
+        """,
+        (PARENT_TABLE,),
+    )
+    months = []
+    for (relname,) in cursor.fetchall():
+        m = _PARTITION_RE.match(relname)
+        if m:
+            months.append(date(int(m.group(1)), int(m.group(2)), 1))
+    return sorted(months)
+
+
+def retention_cutoff(retain_months: int, today: date) -> Optional[date]:
+    """保留期限內最早的月份 (早於此月的 partition 可 detach)；retain_months <= 0 代表不限期，回 None"""
+    if retain_months <= 0:
+        return None
+    return add_months(month_start(today), -(retain_months - 1))
+
+
+def detach_expired_partitions(cursor, retain_months: int, today: Optional[date] = None) -> List[str]:
+    """
+    DETACH 整個月份都早於保留期限的 partition，回傳被 detach 的資料表名稱。
+    retain_months 含當月，例如 12 = 保留當月與前 11 個月。
+    """
+    cutoff = retention_cutoff(retain_months, today or date.today())
+    if cutoff is None:
+        return []
+    detached = []
+    for month in list_month_partitions(cursor):
+        if month < cutoff:
+            name = partition_name(month)
+            cursor.execute(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}")
+            detached.append(name)
+    return detached
+
+
+def maintain_partitions(cursor, months_ahead: int, retain_months: int = 0) -> None:
+    """
+    (必要時先轉換 baseline 的 masks.name 與非 partition 表) default partition + 當月起 months_ahead 個月的 partition，
+    retain_months > 0 時再套用保留期限。
+    先取得 DDL advisory lock：ensure_month_partition 是「先查再建」，
+    多個 worker 同時執行會撞到 "relation already exists"。
+    """
+    lock_ddl(cursor)
+    # 舊購買紀錄的 mask_name 要靠 products 對應，所以先轉 masks
+    migrate_mask_products(cursor)
+    migrate_unpartitioned(cursor)
+    this_month = month_start(date.today())
+    create_default_partition(cursor)
+    ensure_partitions(cursor, [add_months(this_month, i) for i in range(months_ahead + 1)])
+    detach_expired_partitions(cursor, retain_months)
+
+
+def maintain_purchase_partitions(engine, apply_retention: bool = False) -> None:
+    """
+    app 端入口: 用 SQLAlchemy engine 的原生連線執行 maintain_partitions。
+    DETACH PARTITION 會對 purchase_histories 取 ACCESS EXCLUSIVE lock、擋住所有寫入，
+    所以 worker 啟動 (warm-up) 時不套用保留期限，只有 cron 入口 (apply_retention=True) 才會。
+    """
+    from app.config import PURCHASE_PARTITION_MONTHS_AHEAD, PURCHASE_RETENTION_MONTHS
+
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        maintain_partitions(
+            cursor,
+            PURCHASE_PARTITION_MONTHS_AHEAD,
+            PURCHASE_RETENTION_MONTHS if apply_retention else 0,
+        )
+        conn.commit()
+        cursor.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    from app.database import engine
+
+    maintain_purchase_partitions(engine, apply_retention=True)
+    print("[INFO] purchase_histories partitions maintained.")
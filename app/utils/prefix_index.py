@@ -0,0 +1,165 @@
+# app/utils/prefix_index.py
+"""
+/search/suggest 用的記憶體內前綴索引 (sorted keys + bisect)。
+
+- 每個名稱以 casefold 後的全名，以及每個字詞開頭起算的後綴建 key，
+  所以 "green" 也能找到 "MaskT (green) (10 per pack)"
+- 權重 (popularity) 取自 purchase_histories 的筆數：藥局依 pharmacy_id、口罩依 product_id
+- refresh() 只讀取上次之後新增的資料列 (id 遞增)，增量更新索引與權重；
+  ETL 重新匯入 (epoch 改變、id 從 1 重新開始) 時整個索引重建
+- 購買紀錄的 id 在 INSERT 時就配好，較小的 id 可能較晚 commit，
+  所以最後 PURCHASE_RESCAN_WINDOW 個 id 每次都重讀，以 id 去重後才計入權重
+- 查詢完全在記憶體內完成，不碰資料庫
+"""
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import EntityVersion, Pharmacy, Product, PurchaseHistory
+from app.utils.versioning import EPOCH_KEY
+
+_WORD_START = re.compile(r"(?:^|(?<=[\s(\-/]))\w", re.UNICODE)
+# 任何 key 都比 prefix + _MAX_CHAR 小，用來取前綴範圍的右邊界
+_MAX_CHAR = "\U0010ffff"
+
+EntryKey = Tuple[str, int]   # ("pharmacy", pharmacy_id) 或 ("mask", product_id)
+
+# 最後幾個 purchase id 每次 refresh 都重讀 (涵蓋較晚 commit 的交易)
+PURCHASE_RESCAN_WINDOW = 1000
+
+
+def fold(text: str) -> str:
+    return text.casefold().strip()
+
+
+def index_keys(name: str) -> List[str]:
+    """全名 + 每個字詞開頭起算的後綴 (皆已 casefold)"""
+    folded = fold(name)
+    return sorted({folded[m.start():] for m in _WORD_START.finditer(folded)} | {folded})
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._refresh_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        # (sorted keys, 對應的 entry key, entry key -> entry)，整組替換，讀取端不需要加鎖
+        self._state: Tuple[List[str], List[EntryKey], Dict[EntryKey, Dict]] = ([], [], {})
+        self.last_pharmacy_id = 0
+        self.last_product_id = 0
+        # <= last_purchase_id 的紀錄都已計入；之後已計入的 id 記在 _recent_purchase_ids
+        self.last_purchase_id = 0
+        self._recent_purchase_ids: Set[int] = set()
+        self.epoch: Optional[int] = None
+        self.built = False
+
+    @property
+    def entries(self) -> Dict[EntryKey, Dict]:
+        return self._state[2]
+
+    def suggest(self, prefix: str, limit: int) -> List[Dict]:
+        p = fold(prefix)
+        if not p or limit <= 0:
+            return []
+        keys, refs, entries = self._state
+        lo = bisect_left(keys, p)
+        hi = bisect_left(keys, p + _MAX_CHAR, lo)
+        seen = {refs[i] for i in range(lo, hi)}
+        best = heapq.nlargest(
+            limit,
+            (e for e in map(entries.get, seen) if e is not None),
+            key=lambda e: (e["weight"], -len(e["name"])),
+        )
+        return [dict(e) for e in best]
+
+    def refresh(self, db: Session) -> None:
+        """增量更新：新增的藥局 / 口罩名稱，以及新增購買紀錄帶來的權重"""
+        with self._refresh_lock:
+            epoch = db.query(EntityVersion.version).filter(EntityVersion.key == EPOCH_KEY).scalar() or 0
+            if epoch != self.epoch:
+                # ETL 重新匯入：id 重新編號，舊的 entry 與 watermark 都不能用
+                self._reset()
+                self.epoch = epoch
+            new_entries: List[Tuple[EntryKey, Dict]] = []
+
+            for ph_id, name in (db.query(Pharmacy.id, Pharmacy.name)
+                                .filter(Pharmacy.id > self.last_pharmacy_id)
+                                .order_by(Pharmacy.id)):
+                new_entries.append((("pharmacy", ph_id),
+                                    {"type": "pharmacy", "name": name, "pharmacy_id": ph_id, "weight": 0}))
+                self.last_pharmacy_id = ph_id
+
+            for product_id, name in (db.query(Product.id, Product.name)
+                                     .filter(Product.id > self.last_product_id)
+                                     .order_by(Product.id)):
+                new_entries.append((("mask", product_id),
+                                    {"type": "mask", "name": name, "product_id": product_id, "weight": 0}))
+                self.last_product_id = product_id
+
+            self._insert(new_entries)
+            self._add_purchase_weights(db)
+            self.built = True
+
+    def _insert(self, new_entries: List[Tuple[EntryKey, Dict]]) -> None:
+        if not new_entries:
+            return
+        keys, refs, entries = self._state
+        pairs = list(zip(keys, refs))
+        # 新 entry 放進新的 dict，與 keys / refs 一起替換
+        entries = dict(entries)
+        for ref, entry in new_entries:
+            if ref in entries:
+                continue
+            entries[ref] = entry
+            pairs.extend((key, ref) for key in index_keys(entry["name"]))
+        pairs.sort()
+        self._state = ([k for k, _ in pairs], [r for _, r in pairs], entries)
+
+    def _add_weight(self, pharmacy_id: int, product_id: Optional[int], count: int) -> None:
+        pharmacy = self.entries.get(("pharmacy", pharmacy_id))
+        if pharmacy is not None:
+            pharmacy["weight"] += count
+        mask = self.entries.get(("mask", product_id))
+        if mask is not None:
+            mask["weight"] += count
+
+    def _add_purchase_weights(self, db: Session) -> None:
+        max_id = db.query(func.max(PurchaseHistory.id)).scalar() or 0
+        if self.last_purchase_id == 0 and not self._recent_purchase_ids:
+            # 第一次建立：視窗以前的紀錄直接 group by 計數
+            bulk_to = max(max_id - PURCHASE_RESCAN_WINDOW, 0)
+            for ph_id, product_id, cnt in (db.query(
+                                               PurchaseHistory.pharmacy_id,
+                                               PurchaseHistory.product_id,
+                                               func.count(PurchaseHistory.id),
+                                           )
+                                           .filter(PurchaseHistory.id <= bulk_to)
+                                           .group_by(PurchaseHistory.pharmacy_id, PurchaseHistory.product_id)):
+                self._add_weight(ph_id, product_id, cnt)
+            self.last_purchase_id = bulk_to
+
+        # watermark 之後逐筆讀，略過已計入的 id
+        for purchase_id, ph_id, product_id in (db.query(
+                                                   PurchaseHistory.id,
+                                                   PurchaseHistory.pharmacy_id,
+                                                   PurchaseHistory.product_id,
+                                               )
+                                               .filter(PurchaseHistory.id > self.last_purchase_id)):
+            if purchase_id in self._recent_purchase_ids:
+                continue
+            self._recent_purchase_ids.add(purchase_id)
+            self._add_weight(ph_id, product_id, 1)
+
+        # 視窗以前的視為不會再有新 commit，往前推進 watermark
+        settled = max(self.last_purchase_id, max_id - PURCHASE_RESCAN_WINDOW)
+        self._recent_purchase_ids = {i for i in self._recent_purchase_ids if i > settled}
+        self.last_purchase_id = settled
+
+
+suggest_index = SuggestIndex()
@@ -0,0 +1,57 @@
+# app/utils/product_catalog.py
+"""
+記憶體內的商品字典 (products 表)：name <-> product_id。
+
+products 只有幾十筆且幾乎不變，啟動時整張載入；
+遇到沒看過的名稱 (例如 ETL 重新匯入後、下次定期載入前) 才回資料庫查詢。
+商品只由 ETL 建立，app 不會依客戶端送來的名稱新增商品。
+"""
+import threading
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models import Product
+
+
+class ProductCatalog:
+    def __init__(self):
+        self.by_name: Dict[str, int] = {}
+        self.by_id: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def load(self, db: Session) -> None:
+        rows = db.query(Product.id, Product.name).all()
+        with self._lock:
+            self.by_name = {name: pid for pid, name in rows}
+            self.by_id = {pid: name for pid, name in rows}
+
+    def _remember(self, product_id: int, name: str) -> None:
+        # 複製後整個替換，讀取端 (match 等) 不會遇到迭代中被修改的 dict
+        with self._lock:
+            self.by_name = {**self.by_name, name: product_id}
+            self.by_id = {**self.by_id, product_id: name}
+
+    def get_id(self, name: str) -> Optional[int]:
+        return self.by_name.get(name)
+
+    def get_name(self, product_id: int) -> Optional[str]:
+        return self.by_id.get(product_id)
+
+    def lookup(self, db: Session, name: str) -> Optional[int]:
+        """名稱 -> product_id；字典沒有時查資料庫，仍查不到回 None (不新增商品)"""
+        product_id = self.by_name.get(name)
+        if product_id is not None:
+            return product_id
+        product_id = db.query(Product.id).filter(Product.name == name).scalar()
+        if product_id is not None:
+            self._remember(product_id, name)
+        return product_id
+
+    def match(self, q: str) -> List[int]:
+        """名稱包含 q (不分大小寫) 的 product_id"""
+        q = q.lower()
+        return [pid for name, pid in self.by_name.items() if q in name.lower()]
+
+
+product_catalog = ProductCatalog()
@@ -0,0 +1,23 @@
+# app/utils/product_name.py
+"""
+口罩商品名稱解析，例如 "MaskT (green) (10 per pack)" -> ("MaskT", "green", 10)。
+只依賴標準函式庫，etl.py 與 app 共用。
+"""
+import re
+from typing import Optional, Tuple
+
+_PRODUCT_RE = re.compile(
+    r"^\s*(?P<brand>.+?)"
+    r"(?:\s*\((?P<color>(?![^()]*per pack)[^()]+)\))?"
+    r"(?:\s*\((?P<pack>\d+)\s*per pack\))?\s*$",
+    re.IGNORECASE,
+)
+
+
+def parse_product_name(name: str) -> Tuple[str, Optional[str], Optional[int]]:
+    """回傳 (brand, color, pack_size)，無法解析的部分為 None"""
+    m = _PRODUCT_RE.match(name)
+    if not m:
+        return name.strip(), None, None
+    pack = m.group("pack")
+    return m.group("brand").strip(), m.group("color"), int(pack) if pack else None
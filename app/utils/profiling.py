@@ -0,0 +1,386 @@
+# app/utils/profiling.py
+"""
+選用的單一請求 profiling。
+
+啟用方式 (兩者都沒設定時完全不安裝，零額外開銷)：
+- PROFILE_TOKEN：請求帶 `X-Profile: <token>` 就 profile 該請求；
+  再加 `X-Profile-Output: inline` 時，回應內容改為 profile 結果 (JSON)
+- PROFILE_SAMPLE_RATE：依比例隨機抽樣，結果寫到 PROFILE_DIR
+
+每個被 profile 的請求會得到：
+- 各階段耗時 (Server-Timing header)：
+  db = SQL 執行、orm = 路由函式內扣掉 SQL (ORM hydration 等)、
+  validation = 讀取 body、依賴注入與參數驗證、
+  serialization = serialize_response (response_model 驗證 + jsonable_encoder)、
+  render = response class 產生 body (JSON 編碼)、
+  other = 外層 middleware (admission control 排隊、壓縮) 與路由比對等其餘時間。
+  路由直接回傳 Response (例如指定 fields 時) 不經過 serialize_response，
+  JSON 編碼在路由函式內，算在 orm
+- 取樣式 profiler 的 folded stacks (flamegraph.pl / speedscope 可直接讀)，
+  只取樣執行路由函式的 worker thread (同步路由)；event loop thread 同時在處理其他請求，
+  不取樣，避免別的請求混進這個請求的 flamegraph。async 路由因此沒有 stacks，只有各階段耗時
+- 寫檔在 executor 內進行，PROFILE_DIR 只保留最新的 PROFILE_MAX_FILES 份
+"""
+import asyncio
+import functools
+import hmac
+import inspect
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Optional, Set
+
+import fastapi.routing
+from fastapi.datastructures import Default, DefaultPlaceholder
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+from app.config import (
+    PROFILE_DIR, PROFILE_INTERVAL, PROFILE_MAX_FILES, PROFILE_SAMPLE_RATE, PROFILE_TOKEN
+)
+
+PROFILING_ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+_current: ContextVar[Optional["ProfileRun"]] = ContextVar("profile_run", default=None)
+
+
+class ProfileRun:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = Counter()
+        self.in_endpoint = False
+        self.threads: Set[int] = set()
+        self.stacks: Counter = Counter()
+
+    def phases(self) -> Dict[str, float]:
+        """各階段毫秒數"""
+        t = self.timings
+        total = t.get("total") or (time.perf_counter() - self.started)
+        db = t["db_endpoint"] + t["db_other"]
+        phases = {
+            "db": db,
+            "orm": max(t["endpoint"] - t["db_endpoint"], 0.0),
+            "validation": max(t["handler"] - t["endpoint"] - t["serialization"] - t["render"] - t["db_other"], 0.0),
+            "serialization": t["serialization"],
+            "render": t["render"],
+            "other": max(total - t["handler"], 0.0),
+            "total": total,
+        }
+        return {k: round(v * 1000, 3) for k, v in phases.items()}
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename.replace(os.sep, "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+def _fold(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class _Sampler(threading.Thread):
+    """每 interval 秒取樣一次 run.threads 內各執行緒的 call stack"""
+
+    def __init__(self, run: ProfileRun, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.run_ = run
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for tid in list(self.run_.threads):
+                frame = frames.get(tid)
+                if frame is not None:
+                    self.run_.stacks[_fold(frame)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# ---- SQL 計時 ----
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    run = _current.get()
+    starts = conn.info.get("profile_query_start")
+    if run is None or not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    run.timings["db_endpoint" if run.in_endpoint else "db_other"] += elapsed
+
+
+def install_sql_timing(engine) -> None:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ---- 路由計時 ----
+def _timed_endpoint(func):
+    """包住路由函式，量測路由本身 (含 SQL) 的時間；沒有在 profile 時直接呼叫"""
+    def enter(sample_thread: bool):
+        run = _current.get()
+        if run is not None:
+            run.in_endpoint = True
+            if sample_thread:
+                run.threads.add(threading.get_ident())
+        return run, time.perf_counter()
+
+    def leave(run, start):
+        run.timings["endpoint"] += time.perf_counter() - start
+        run.in_endpoint = False
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            # event loop thread 由所有請求共用，不取樣
+            run, start = enter(sample_thread=False)
+            if run is None:
+                return await func(*args, **kwargs)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                leave(run, start)
+        async_wrapper._profiled = True
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # 同步路由在 threadpool 的 worker thread 上執行，只屬於這個請求
+        run, start = enter(sample_thread=True)
+        if run is None:
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            run.threads.discard(threading.get_ident())
+            leave(run, start)
+    wrapper._profiled = True
+    return wrapper
+
+
+@functools.lru_cache(maxsize=None)
+def _timed_response_class(response_class):
+    """response class 的子類別，量測 render() (產生 body) 的時間"""
+    if getattr(response_class, "_profiled", False):
+        return response_class
+
+    class TimedResponse(response_class):
+        _profiled = True
+
+        def render(self, content):
+            run = _current.get()
+            if run is None:
+                return super().render(content)
+            start = time.perf_counter()
+            try:
+                return super().render(content)
+            finally:
+                run.timings["render"] += time.perf_counter() - start
+
+    TimedResponse.__name__ = TimedResponse.__qualname__ = response_class.__name__
+    return TimedResponse
+
+
+def _timed_serialize_response(serialize_response):
+    """包住 fastapi.routing.serialize_response (response_model 驗證 + jsonable_encoder)"""
+    if getattr(serialize_response, "_profiled", False):
+        return serialize_response
+
+    @functools.wraps(serialize_response)
+    async def wrapper(*args, **kwargs):
+        run = _current.get()
+        if run is None:
+            return await serialize_response(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await serialize_response(*args, **kwargs)
+        finally:
+            run.timings["serialization"] += time.perf_counter() - start
+    wrapper._profiled = True
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """
+    PROFILING_ENABLED 時替路由加上計時，否則與 APIRoute 完全相同。
+    用法: APIRouter(..., route_class=ProfiledRoute)
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        # include_router 會用已包過的 endpoint / response class 再建一次 route，不要重複包
+        if PROFILING_ENABLED:
+            if not getattr(endpoint, "_profiled", False):
+                endpoint = _timed_endpoint(endpoint)
+            response_class = kwargs.get("response_class")
+            if isinstance(response_class, DefaultPlaceholder):
+                # 保留 Default，include_router 才會照常套用 router 層級的 default_response_class
+                kwargs["response_class"] = Default(_timed_response_class(response_class.value))
+            elif response_class is not None:
+                kwargs["response_class"] = _timed_response_class(response_class)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        if not PROFILING_ENABLED:
+            return handler
+
+        async def timed_handler(request):
+            run = _current.get()
+            if run is None:
+                return await handler(request)
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                run.timings["handler"] += time.perf_counter() - start
+
+        return timed_handler
+
+
+# ---- middleware ----
+def _header(scope, name: bytes) -> Optional[str]:
+    for k, v in scope.get("headers", []):
+        if k.lower() == name:
+            return v.decode("latin-1")
+    return None
+
+
+def _server_timing(phases: Dict[str, float]) -> bytes:
+    return ", ".join(f"{name};dur={ms}" for name, ms in phases.items()).encode()
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, token: str, sample_rate: float, output_dir: str, interval: float, max_files: int):
+        self.app = app
+        self.token = token
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_files = max_files
+
+    def _wants_profile(self, scope) -> Optional[str]:
+        """回傳輸出方式 "inline" / "file"，不 profile 時回 None"""
+        if self.token:
+            given = _header(scope, b"x-profile")
+            if given is not None and hmac.compare_digest(given, self.token):
+                return "inline" if _header(scope, b"x-profile-output") == "inline" else "file"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "file"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        mode = self._wants_profile(scope) if scope["type"] == "http" else None
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        run = ProfileRun()
+        token = _current.set(run)
+        sampler = _Sampler(run, self.interval)
+        sampler.start()
+        status = {"code": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if mode == "inline":
+                    return
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(run.phases())))
+                message = {**message, "headers": headers}
+            elif mode == "inline":
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            run.timings["total"] = time.perf_counter() - run.started
+            sampler.stop()
+            _current.reset(token)
+
+        result = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status["code"],
+            "phases_ms": run.phases(),
+            "samples": sum(run.stacks.values()),
+        }
+        if mode == "inline":
+            result["folded"] = run.folded()
+            body = json.dumps(result).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"server-timing", _server_timing(result["phases_ms"])),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+        else:
+            # 寫檔是 blocking I/O，不在 event loop 上做
+            await asyncio.get_running_loop().run_in_executor(None, self._dump, result, run)
+
+    def _dump(self, result: dict, run: ProfileRun) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", result["path"]).strip("_") or "root"
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{result['method']}-{slug}"
+        base = os.path.join(self.output_dir, name)
+        with open(f"{base}.folded", "w", encoding="utf-8") as f:
+            f.write(run.folded() + "\n")
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        self._rotate()
+
+    def _rotate(self) -> None:
+        """只保留最新的 max_files 份 (檔名以時間開頭，依名稱排序即依時間排序)"""
+        bases = sorted({os.path.splitext(name)[0] for name in os.listdir(self.output_dir)
+                        if name.endswith((".folded", ".json"))})
+        for base in bases[:max(len(bases) - self.max_files, 0)]:
+            for ext in (".folded", ".json"):
+                try:
+                    os.remove(os.path.join(self.output_dir, base + ext))
+                except FileNotFoundError:
+                    pass  # 其他 worker 已經刪掉
+
+
+def install_profiling(app, engine) -> None:
+    """
+    PROFILING_ENABLED 時才掛上 middleware 與 SQL / serialize_response 計時。
+    要在其他 middleware 之後呼叫，profiling 才會是最外層，other 才包含那些 middleware。
+    """
+    if not PROFILING_ENABLED:
+        return
+    install_sql_timing(engine)
+    # get_request_handler 執行時才從 fastapi.routing 模組查 serialize_response，沒有其他掛勾點
+    fastapi.routing.serialize_response = _timed_serialize_response(fastapi.routing.serialize_response)
+    app.add_middleware(
+        ProfilingMiddleware,
+        token=PROFILE_TOKEN,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        output_dir=PROFILE_DIR,
+        interval=PROFILE_INTERVAL,
+        max_files=PROFILE_MAX_FILES,
+    )
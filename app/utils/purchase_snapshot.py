@@ -0,0 +1,267 @@
+# app/utils/purchase_snapshot.py
+"""
+purchase_histories 的欄式 (columnar) 快照。
+
+匯出: 依 transaction_date 排序，每個欄位各寫成一個 .npy 檔 (可 memory-map)。
+查詢: 用 timestamp 欄位二分搜尋出日期區間，再以 NumPy bincount / sum 聚合，
+      聚合本身不碰 OLTP 資料庫。
+
+快照只是某個時間點的複本：purchase_masks 寫入的 transaction_date 由客戶端決定，
+匯出後仍可能新增 exported_at 之前的紀錄，ETL 重新匯入也會整批換掉資料。
+因此 meta.json 記錄匯出當下的最大 purchase id 與版本 epoch (high-water mark)，
+背景定期以一個小查詢確認資料庫沒有超出 high-water mark 的紀錄 (check_current)，
+有的話 covers() 回 False，由呼叫端改查資料庫，直到重新匯出為止。
+
+    python -m app.utils.purchase_snapshot /var/lib/kdan/purchase_snapshot
+"""
+import json
+import os
+import shutil
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.config import PURCHASE_SNAPSHOT_DIR
+from app.models import EntityVersion, PurchaseHistory, User
+from app.utils.versioning import EPOCH_KEY
+
+# 欄位名稱 -> dtype
+COLUMNS = {
+    "user_id": np.int32,
+    "pharmacy_id": np.int32,
+    "mask_id": np.int32,        # NULL 以 -1 表示
+    "product_id": np.int32,     # NULL 以 -1 表示
+    "quantity": np.int32,
+    "amount": np.float64,
+    "timestamp": "datetime64[s]",
+}
+META_FILE = "meta.json"
+USERS_FILE = "users.json"
+EXPORT_CHUNK = 50_000
+
+
+def export_snapshot(db: Session, target_dir: str) -> int:
+    """
+    將 purchase_histories 匯出到 target_dir，回傳匯出筆數。
+    先寫到暫存目錄，完成後再整個換掉，讀取端不會看到寫一半的檔案。
+    """
+    # count 與逐筆讀取需在同一個資料快照內，否則中途新增的紀錄會讓筆數對不上
+    db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    exported_at = naive_utc(datetime.now(timezone.utc))
+    total = (db.query(PurchaseHistory)
+             .filter(PurchaseHistory.transaction_date <= exported_at)
+             .count())
+    max_purchase_id = db.query(func.max(PurchaseHistory.id)).scalar() or 0
+    epoch = _epoch(db)
+
+    tmp_dir = f"{target_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    arrays = {
+        name: np.lib.format.open_memmap(
+            os.path.join(tmp_dir, f"{name}.npy"), mode="w+", dtype=dtype, shape=(total,)
+        )
+        for name, dtype in COLUMNS.items()
+    }
+
+    rows = (db.query(
+                PurchaseHistory.user_id,
+                PurchaseHistory.pharmacy_id,
+                PurchaseHistory.mask_id,
+                PurchaseHistory.product_id,
+                PurchaseHistory.quantity,
+                PurchaseHistory.transaction_amount,
+                PurchaseHistory.transaction_date,
+            )
+            .filter(PurchaseHistory.transaction_date <= exported_at)
+            .order_by(PurchaseHistory.transaction_date)
+            .yield_per(EXPORT_CHUNK))
+
+    # 分批寫入，避免整張表一次載進記憶體
+    offset = 0
+    chunk: List[Tuple] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= EXPORT_CHUNK:
+            offset = _write_chunk(arrays, chunk, offset)
+            chunk = []
+    if chunk:
+        offset = _write_chunk(arrays, chunk, offset)
+
+    for arr in arrays.values():
+        arr.flush()
+    del arrays
+
+    users = {str(uid): name for uid, name in db.query(User.id, User.name)}
+    with open(os.path.join(tmp_dir, USERS_FILE), "w", encoding="utf-8") as f:
+        json.dump(users, f, ensure_ascii=False)
+    with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "rows": offset,
+            "exported_at": exported_at.isoformat(),
+            "max_purchase_id": max_purchase_id,
+            "epoch": epoch,
+        }, f)
+
+    old_dir = f"{target_dir}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(target_dir):
+        os.rename(target_dir, old_dir)
+    os.rename(tmp_dir, target_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return offset
+
+
+def _epoch(db: Session) -> int:
+    return db.query(EntityVersion.version).filter(EntityVersion.key == EPOCH_KEY).scalar() or 0
+
+
+def _write_chunk(arrays: Dict[str, np.ndarray], chunk: List[Tuple], offset: int) -> int:
+    end = offset + len(chunk)
+    user_ids, pharmacy_ids, mask_ids, product_ids, quantities, amounts, dates = zip(*chunk)
+    arrays["user_id"][offset:end] = user_ids
+    arrays["pharmacy_id"][offset:end] = pharmacy_ids
+    arrays["mask_id"][offset:end] = [-1 if m is None else m for m in mask_ids]
+    arrays["product_id"][offset:end] = [-1 if p is None else p for p in product_ids]
+    arrays["quantity"][offset:end] = [1 if q is None else q for q in quantities]
+    arrays["amount"][offset:end] = [0.0 if a is None else a for a in amounts]
+    arrays["timestamp"][offset:end] = np.array(dates, dtype="datetime64[s]")
+    return end
+
+
+def naive_utc(dt: datetime) -> datetime:
+    """帶時區的 datetime 轉成 naive UTC (快照的 timestamp 欄位不帶時區)"""
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class PurchaseSnapshot:
+    """
+    唯讀、memory-mapped 的快照。
+    只能回答 end_date <= exported_at、且資料庫沒有超出 high-water mark 之紀錄時的查詢，
+    其餘情況 covers() 回 False，由呼叫端改查資料庫。
+    是否仍是最新 (current) 由背景定期呼叫 check_current() 更新 (app/main.py)，
+    請求路徑只讀記憶體；剛載入、還沒檢查過的快照視為過期。
+    """
+
+    def __init__(self, snapshot_dir: str):
+        with open(os.path.join(snapshot_dir, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(snapshot_dir, USERS_FILE), encoding="utf-8") as f:
+            self.user_names = {int(k): v for k, v in json.load(f).items()}
+        self.exported_at = datetime.fromisoformat(meta["exported_at"])
+        self.rows = meta["rows"]
+        # 舊版 meta.json 沒有 high-water mark，視為永遠過期
+        self.max_purchase_id = meta.get("max_purchase_id")
+        self.epoch = meta.get("epoch")
+        self.columns = {
+            name: np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode="r")
+            for name in COLUMNS
+        }
+        self.current = False
+
+    def covers(self, end_date: datetime) -> bool:
+        return self.current and naive_utc(end_date) <= self.exported_at
+
+    def check_current(self, db: Session) -> bool:
+        self.current = self.is_current(db)
+        return self.current
+
+    def is_current(self, db: Session) -> bool:
+        """
+        ETL 沒有重新匯入 (epoch 相同)，且匯出後沒有新增 transaction_date <= exported_at 的紀錄。
+        注意：與匯出同時進行、id 較小但較晚 commit 的交易無法由 id 判斷，仍可能遺漏。
+        """
+        if self.max_purchase_id is None or _epoch(db) != self.epoch:
+            return False
+        newer = (db.query(PurchaseHistory.id)
+                 .filter(PurchaseHistory.id > self.max_purchase_id,
+                         PurchaseHistory.transaction_date <= self.exported_at)
+                 .limit(1)
+                 .first())
+        return newer is None
+
+    def _range(self, start_date: datetime, end_date: datetime) -> slice:
+        ts = self.columns["timestamp"]
+        lo = np.searchsorted(ts, np.datetime64(naive_utc(start_date), "s"), side="left")
+        hi = np.searchsorted(ts, np.datetime64(naive_utc(end_date), "s"), side="right")
+        return slice(lo, max(lo, hi))
+
+    def top_spenders(self, start_date: datetime, end_date: datetime, top_x: int) -> List[Dict]:
+        rng = self._range(start_date, end_date)
+        user_ids = self.columns["user_id"][rng]
+        if top_x <= 0 or user_ids.size == 0:
+            return []
+        totals = np.bincount(user_ids, weights=self.columns["amount"][rng])
+        counts = np.bincount(user_ids)
+        candidates = np.flatnonzero(counts)
+        if candidates.size > top_x:
+            part = np.argpartition(-totals[candidates], top_x - 1)[:top_x]
+            candidates = candidates[part]
+        ordered = candidates[np.argsort(-totals[candidates], kind="stable")]
+        return [
+            {
+                "user_id": int(uid),
+                "user_name": self.user_names.get(int(uid), ""),
+                "total_spent": float(totals[uid]),
+            }
+            for uid in ordered
+        ]
+
+    def transaction_summary(self, start_date: datetime, end_date: datetime) -> Tuple[int, float]:
+        rng = self._range(start_date, end_date)
+        total_masks = int(self.columns["quantity"][rng].sum(dtype=np.int64))
+        total_dollar = float(self.columns["amount"][rng].sum())
+        return total_masks, total_dollar
+
+
+_snapshot: Optional[PurchaseSnapshot] = None
+_snapshot_mtime: Optional[Tuple[int, int]] = None
+_lock = threading.Lock()
+
+
+def get_snapshot() -> Optional[PurchaseSnapshot]:
+    """
+    取得目前的快照；PURCHASE_SNAPSHOT_DIR 未設定或尚未匯出時回傳 None。
+    目錄被重新匯出 (meta.json 變動) 時會自動重新載入。
+    """
+    global _snapshot, _snapshot_mtime
+    if not PURCHASE_SNAPSHOT_DIR:
+        return None
+    meta_path = os.path.join(PURCHASE_SNAPSHOT_DIR, META_FILE)
+    try:
+        st = os.stat(meta_path)
+        mtime = (st.st_ino, st.st_mtime_ns)
+    except OSError:
+        return None
+    if _snapshot is None or mtime != _snapshot_mtime:
+        with _lock:
+            if _snapshot is None or mtime != _snapshot_mtime:
+                try:
+                    _snapshot = PurchaseSnapshot(PURCHASE_SNAPSHOT_DIR)
+                    _snapshot_mtime = mtime
+                except (OSError, ValueError, KeyError):
+                    # 匯出途中被換目錄等狀況，下次請求再試
+                    return _snapshot
+    return _snapshot
+
+
+if __name__ == "__main__":
+    from app.database import SessionLocal
+
+    target = sys.argv[1] if len(sys.argv) > 1 else PURCHASE_SNAPSHOT_DIR
+    if not target:
+        sys.exit("usage: python -m app.utils.purchase_snapshot <target_dir>")
+    session = SessionLocal()
+    try:
+        n = export_snapshot(session, target)
+    finally:
+        session.close()
+    print(f"[INFO] Exported {n} purchase records to {target}.")
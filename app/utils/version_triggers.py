@@ -0,0 +1,86 @@
+# app/utils/version_triggers.py
+"""
+資料庫端的 entity_versions 觸發器。
+
+pharmacies / masks / pharmacy_opening_hours 的任何異動 (app、ETL、手動 SQL 都一樣) 都會遞增對應藥局的版本，
+ETag (app/utils/versioning.py) 與比價索引 (app/utils/offer_index.py) 依此得知資料已變更：
+
+- pharmacies             -> pharmacy:<id> (改名、cash_balance、新增藥局)
+- masks                  -> pharmacy_masks:<pharmacy_id>
+- pharmacy_opening_hours -> pharmacy_hours:<pharmacy_id>、pharmacy:<pharmacy_id>
+
+使用 statement-level trigger + transition table，一個 SQL 敘述不論改幾列，
+每個藥局只 upsert 一次 (依 key 排序，避免 deadlock)。
+
+這裡只依賴標準函式庫，函式吃 DB-API cursor，etl.py 與 app warm-up 共用。
+"""
+from typing import Dict, List, Tuple
+
+# table -> (藥局 id 欄位, 異動時要遞增的 key 前綴 (後面接藥局 id))
+TRIGGER_PREFIXES: Dict[str, Tuple[str, List[str]]] = {
+    "pharmacies": ("id", ["pharmacy:"]),
+    "masks": ("pharmacy_id", ["pharmacy_masks:"]),
+    "pharmacy_opening_hours": ("pharmacy_id", ["pharmacy_hours:", "pharmacy:"]),
+}
+
+# TG_ARGV[0] 是藥局 id 的欄位名稱，其餘是 key 前綴
+FUNCTION_DDL = """
+CREATE OR REPLACE FUNCTION bump_pharmacy_versions() RETURNS trigger AS $$
+DECLARE
+    ids INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        EXECUTE format('SELECT array_agg(DISTINCT %I) FROM new_rows', TG_ARGV[0]) INTO ids;
+    ELSIF TG_OP = 'DELETE' THEN
+        EXECUTE format('SELECT array_agg(DISTINCT %I) FROM old_rows', TG_ARGV[0]) INTO ids;
+    ELSE
+        EXECUTE format('SELECT array_agg(DISTINCT %1$I) FROM (SELECT %1$I FROM new_rows '
+                       'UNION SELECT %1$I FROM old_rows) changed', TG_ARGV[0]) INTO ids;
+    END IF;
+    FOR i IN 1 .. TG_NARGS - 1 LOOP
+        INSERT INTO entity_versions (key, version)
+        SELECT TG_ARGV[i] || pharmacy_id, 1 FROM unnest(ids) AS pharmacy_id ORDER BY 1
+        ON CONFLICT (key) DO UPDATE SET version = entity_versions.version + 1;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# transition table 不能用在多個事件的 trigger 上，所以 INSERT / UPDATE / DELETE 各一個
+_EVENTS = {
+    "INSERT": "NEW TABLE AS new_rows",
+    "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "OLD TABLE AS old_rows",
+}
+
+
+def ensure_key_collation(cursor) -> bool:
+    """
+    之前建立的 entity_versions.key 是資料庫預設 collation，改成 "C"，
+    前綴範圍查詢才能走主鍵索引 (會重建主鍵索引，表很小)。回傳是否有修改。
+    """
+    cursor.execute(
+        "SELECT collation_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'entity_versions' AND column_name = 'key'"
+    )
+    row = cursor.fetchone()
+    if row is None or row[0] == "C":
+        return False
+    cursor.execute('ALTER TABLE entity_versions ALTER COLUMN key TYPE VARCHAR(64) COLLATE "C"')
+    return True
+
+
+def install_version_triggers(cursor) -> None:
+    """建立 / 更新觸發器 (可重複執行)；呼叫端負責 commit"""
+    ensure_key_collation(cursor)
+    cursor.execute(FUNCTION_DDL)
+    for table, (id_column, prefixes) in TRIGGER_PREFIXES.items():
+        args = ", ".join(f"'{arg}'" for arg in [id_column, *prefixes])
+        for event, transition in _EVENTS.items():
+            name = f"{table}_version_{event.lower()}"
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+            cursor.execute(
+                f"CREATE TRIGGER {name} AFTER {event} ON {table} REFERENCING {transition} "
+                f"FOR EACH STATEMENT EXECUTE FUNCTION bump_pharmacy_versions({args})"
+            )
@@ -0,0 +1,125 @@
+# app/utils/versioning.py
+"""
+以版本號產生 strong ETag，支援 If-None-Match -> 304。
+
+- 寫入端 (purchase_masks) 呼叫 bump_versions() 遞增對應 key；
+  藥局 / masks / 營業時間由資料庫觸發器遞增 (app/utils/version_triggers.py)，app 外的修改也會反映
+- 讀取端只查 entity_versions (主鍵查詢)，版本沒變就直接回 304，不跑原本的查詢
+- "epoch" 由 ETL 以當下毫秒時間重設，重新匯入後舊的 ETag 一律失效
+- 清單類 (例如所有藥局) 的版本是各個 key 的總和，避免所有寫入都搶同一列
+"""
+import zlib
+from typing import Callable, Iterable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models import EntityVersion
+from app.utils.compression import ETAG_SUFFIXES
+
+EPOCH_KEY = "epoch"
+
+
+def pharmacy_masks_key(pharmacy_id: int) -> str:
+    """藥局販售的口罩 (品項、價格)"""
+    return f"pharmacy_masks:{pharmacy_id}"
+
+
+def user_purchases_key(user_id: int) -> str:
+    return f"user_purchases:{user_id}"
+
+
+# 藥局本身 (名稱、cash_balance、營業時間)，只由資料庫觸發器遞增
+PHARMACY_PREFIX = "pharmacy:"
+PHARMACY_MASKS_PREFIX = "pharmacy_masks:"
+# 營業時間 (只由資料庫觸發器遞增；pharmacy: 每次購買都會變，不適合給比價索引用)
+PHARMACY_HOURS_PREFIX = "pharmacy_hours:"
+
+
+def bump_versions(db: Session, keys: Iterable[str]) -> None:
+    """
+    在呼叫端的交易內遞增版本號，與資料異動一起 commit / rollback。
+    依 key 排序後再更新，避免多筆交易以不同順序鎖列造成 deadlock。
+    """
+    for key in sorted(set(keys)):
+        stmt = insert(EntityVersion).values(key=key, version=1)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[EntityVersion.key],
+            set_={"version": EntityVersion.version + 1},
+        ))
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    """以 prefix 開頭的 key 都 < 這個字串，例如 "pharmacy:" -> "pharmacy;" (key 為 "C" collation)"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def current_version(db: Session, key: Optional[str] = None, prefix: Optional[str] = None) -> str:
+    """
+    單一 key 的版本，或所有以 prefix 開頭之 key 的版本總和 (皆含 epoch)。
+    前綴用範圍條件而不是 LIKE：LIKE 在非 C collation 下用不到主鍵索引，"_" 也會被當成萬用字元。
+    """
+    if key is not None:
+        target = EntityVersion.key == key
+    else:
+        target = and_(EntityVersion.key >= prefix, EntityVersion.key < prefix_upper_bound(prefix))
+    epoch, version = (db.query(
+                          func.coalesce(func.max(case((EntityVersion.key == EPOCH_KEY, EntityVersion.version))), 0),
+                          func.coalesce(func.sum(case((target, EntityVersion.version))), 0),
+                      )
+                      .filter(or_(EntityVersion.key == EPOCH_KEY, target))
+                      .one())
+    return f"{epoch}.{version}"
+
+
+def make_etag(name: str, version: str, request: Request) -> str:
+    """
+    同一份資料的不同表示 (sort_by 等 query 參數) 需要不同的 strong ETag，
+    所以把 query string 的 crc32 一起放進去。
+    """
+    variant = zlib.crc32(str(sorted(request.query_params.multi_items())).encode())
+    return f'"{name}-{version}-{variant:08x}"'
+
+
+def _matching_etag(request: Request, etag: str, exists: Optional[Callable[[], bool]] = None) -> Optional[str]:
+    """
+    If-None-Match 中與 etag 相符的那一個 tag (原樣，含壓縮後綴)，沒有相符時回 None。
+    304 要帶回與原本 200 相同的 validator，所以回傳客戶端送來的形式。
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    for raw in header.split(","):
+        raw = raw.strip()
+        tag = raw[2:] if raw.startswith("W/") else raw  # If-None-Match 使用 weak comparison
+        for suffix in ETAG_SUFFIXES:
+            # 壓縮過的表示 (CompressionMiddleware 加的後綴) 對應同一個版本
+            if tag.endswith(f'{suffix}"'):
+                tag = tag[:-len(suffix) - 1] + '"'
+                break
+        if tag == etag:
+            return raw
+        if tag == "*" and (exists is None or exists()):
+            return etag
+    return None
+
+
+def check_etag(
+    request: Request,
+    response: Response,
+    etag: str,
+    exists: Optional[Callable[[], bool]] = None,
+) -> Optional[Response]:
+    """
+    版本相同 => 回傳 304 Response (ETag 與客戶端手上那份 200 相同，含壓縮後綴)，路由直接 return；
+    否則把 ETag 掛到 response 上，回傳 None 讓路由照常查詢。
+    exists: 資源可能不存在 (會回 404) 的路由傳入檢查函式，
+    只在 If-None-Match: * 時才呼叫，資源不存在時不回 304。
+    """
+    matched = _matching_etag(request, etag, exists)
+    if matched is not None:
+        return Response(status_code=304, headers={"ETag": matched, "Cache-Control": "no-cache"})
+    response.headers.update({"ETag": etag, "Cache-Control": "no-cache"})
+    return None
@@ -0,0 +1,181 @@
+# app/utils/warmup.py
+"""
+啟動 warm-up：在接流量之前先把冷啟動成本付掉。
+
+1. 建表、安裝版本號觸發器、維護 purchase_histories partition (原本在 import 時執行)
+2. configure_mappers()，避免第一個請求才設定 SQLAlchemy mapper
+3. 把連線池開到 DB_POOL_SIZE
+4. 每個熱門路由的查詢各跑一次，讓 SQLAlchemy 的 compiled statement cache 先有資料
+5. 載入快照、商品字典、建立 /search/suggest 的前綴索引與比價索引等目錄資料
+
+全部完成後 is_ready() 才回 True，/ready 依此回應。
+失敗時以指數退避重試 (WARMUP_RETRY_INITIAL_SECONDS ~ WARMUP_RETRY_MAX_SECONDS)，直到成功或 stop_warm_up()。
+多個 worker 同時啟動時，建表與 partition DDL 以 advisory lock 序列化。
+"""
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+from app.config import DB_POOL_SIZE, WARMUP_RETRY_INITIAL_SECONDS, WARMUP_RETRY_MAX_SECONDS
+from app.database import Base, SessionLocal, engine
+from app.models import Mask, Pharmacy, User
+from app.routers import pharmacies, search, users
+from app.utils.offer_index import offer_index
+from app.utils.partitions import DDL_LOCK_KEY, maintain_purchase_partitions
+from app.utils.prefix_index import suggest_index
+from app.utils.product_catalog import product_catalog
+from app.utils.purchase_snapshot import get_snapshot
+from app.utils.version_triggers import install_version_triggers
+
+logger = logging.getLogger(__name__)
+
+_ready = False
+_stop = threading.Event()
+
+# 不會命中任何資料的 id / 關鍵字，只為了讓查詢被編譯、執行一次
+_NO_ID = 0
+_NO_MATCH = "__warmup__"
+_EPOCH = datetime(1970, 1, 1)
+
+
+def is_ready() -> bool:
+    return _ready
+
+
+def refresh_catalog_indexes() -> None:
+    """重新載入商品字典並增量更新 suggest 索引 (warm-up 與定期更新共用)"""
+    db = SessionLocal()
+    try:
+        product_catalog.load(db)
+        suggest_index.refresh(db)
+    finally:
+        db.close()
+
+
+def refresh_offer_index() -> None:
+    """價格 / 營業時間版本有變時重建比價索引 (warm-up 與定期更新共用)"""
+    db = SessionLocal()
+    try:
+        offer_index.refresh(db)
+    finally:
+        db.close()
+
+
+def refresh_snapshot_status() -> None:
+    """(重新) 載入購買紀錄快照並檢查是否仍是最新 (warm-up 與定期更新共用)"""
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return
+    db = SessionLocal()
+    try:
+        snapshot.check_current(db)
+    finally:
+        db.close()
+
+
+def _prefill_pool() -> None:
+    conns = [engine.connect() for _ in range(DB_POOL_SIZE)]
+    for conn in conns:
+        conn.close()
+
+
+def _request() -> Request:
+    """給需要 Request / Response 參數 (ETag) 的路由用的空請求"""
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": []})
+
+
+def _hot_queries(db) -> List[Tuple[str, Callable[[], object]]]:
+    return [
+        ("pharmacies.open", lambda: pharmacies.get_open_pharmacies(
+            "Mon", "00:00", request=_request(), response=Response(), db=db)),
+        ("pharmacies.masks", lambda: pharmacies.list_masks_of_pharmacy(
+            _NO_ID, request=_request(), response=Response(), sort_by=None, db=db)),
+        ("pharmacies.masks?sort_by=name", lambda: pharmacies.list_masks_of_pharmacy(
+            _NO_ID, request=_request(), response=Response(), sort_by="name", db=db)),
+        ("pharmacies.masks?sort_by=price", lambda: pharmacies.list_masks_of_pharmacy(
+            _NO_ID, request=_request(), response=Response(), sort_by="price", db=db)),
+        ("pharmacies.masks_batch", lambda: pharmacies.list_masks_of_pharmacies(
+            str(_NO_ID), sort_by="price", db=db)),
+        ("pharmacies.filter", lambda: pharmacies.filter_pharmacies_mask_count("gt", 0, -1, -1, db)),
+        ("pharmacies.all_masks", lambda: pharmacies.list_all_masks(db=db)),
+        ("users.purchases", lambda: users.get_user_purchases(
+            _NO_ID, request=_request(), response=Response(), db=db)),
+        ("users.purchases_batch", lambda: users.get_users_purchases(str(_NO_ID), db=db)),
+        ("users.top_spenders", lambda: users.top_spenders(_EPOCH, _EPOCH, 1, db)),
+        ("users.transactions_summary", lambda: users.transaction_summary(_EPOCH, _EPOCH, db)),
+        ("search", lambda: search.search_pharmacies_and_masks(_NO_MATCH, db=db)),
+        # purchase_masks 有副作用，只跑它用到的查詢
+        ("users.purchase", lambda: (
+            db.query(User).filter(User.id == _NO_ID).first(),
+            db.query(Pharmacy).filter(Pharmacy.id == _NO_ID).first(),
+            db.query(Mask).filter(Mask.id == _NO_ID, Mask.pharmacy_id == _NO_ID).first(),
+        )),
+    ]
+
+
+def warm_up() -> None:
+    """失敗就等一下再整個重跑 (每個步驟都可重複執行)；重試期間保持 not ready"""
+    global _ready
+    _ready = False
+    _stop.clear()
+    delay = WARMUP_RETRY_INITIAL_SECONDS
+    while not _stop.is_set():
+        try:
+            _warm_up()
+        except Exception:
+            logger.exception("warm-up failed, retrying in %.1fs", delay)
+            if _stop.wait(delay):
+                return
+            delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+            continue
+        _ready = True
+        return
+
+
+def stop_warm_up() -> None:
+    """關閉時呼叫，中止還在重試的 warm-up"""
+    _stop.set()
+
+
+def _create_tables() -> None:
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # 與 maintain_partitions 共用同一把 lock，多個 worker 不會同時建表
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": DDL_LOCK_KEY})
+        Base.metadata.create_all(bind=conn)
+        if conn.dialect.name == "postgresql":
+            # 價格 / 營業時間在 app 外被修改時也要遞增版本 (ETag)
+            install_version_triggers(conn.connection.cursor())
+
+
+def _warm_up() -> None:
+    # 若想在首次啟動時自動建表 (僅開發環境建議)
+    # 不建議生產環境自動執行，避免破壞既有資料
+    _create_tables()
+    # purchase_histories 為 partitioned table，需有 partition 才能寫入
+    maintain_purchase_partitions(engine)
+
+    configure_mappers()
+    _prefill_pool()
+
+    db = SessionLocal()
+    try:
+        for name, run in _hot_queries(db):
+            try:
+                run()
+            except HTTPException:
+                pass  # 例如 404，查詢本身已經跑過了
+            except Exception:
+                logger.exception("warm-up query %s failed", name)
+                db.rollback()
+    finally:
+        db.close()
+
+    refresh_snapshot_status()
+    refresh_catalog_indexes()
+    refresh_offer_index()
@@ -4,8 +4,16 @@
 import psycopg2
 import json
 import re
+import time
 from datetime import datetime
 
+from app.utils.mask_products import PRODUCTS_DDL
+from app.utils.partitions import (
+    PARENT_DDL, create_default_partition, ensure_partitions, add_months, month_start, partition_name
+)
+from app.utils.product_name import parse_product_name
+from app.utils.version_triggers import install_version_triggers
+
 # ===【1) 資料庫連線設定】===
 DB_HOST = "localhost"
 DB_PORT = 5432
@@ -13,6 +21,9 @@ DB_NAME = "KDAN"
 DB_USER = "postgres"
 DB_PASSWORD = 8510
 
+# 匯入時預先建立到未來幾個月的 purchase_histories partition
+PARTITION_MONTHS_AHEAD = 3
+
 # === 2) 建立 ENUM 與五個資料表 (無 address, phone) ===
 def create_tables():
     """
@@ -20,16 +31,21 @@ def create_tables():
       1. ENUM day_of_week_enum (含 'Thur')
       2. pharmacies (id, name, cash_balance)
       3. pharmacy_opening_hours (id, pharmacy_id, day_of_week, open_time, close_time)
-      4. masks (id, pharmacy_id, name, price)
-      5. users (id, name, cash_balance)
-      6. purchase_histories (id, user_id, pharmacy_id, mask_id, mask_name, quantity, transaction_amount, transaction_date)
+      4. products (id, name, brand, color, pack_size)
+      5. masks (id, pharmacy_id, product_id, price)
+      6. users (id, name, cash_balance)
+      7. purchase_histories (id, user_id, pharmacy_id, mask_id, product_id, quantity, transaction_amount, transaction_date)
+         依 transaction_date 按月 RANGE partition，另有 default partition
+      8. entity_versions (key, version) — ETag 用的版本號
     """
     drop_schema_sql = """
     DROP TABLE IF EXISTS purchase_histories CASCADE;
     DROP TABLE IF EXISTS masks CASCADE;
+    DROP TABLE IF EXISTS products CASCADE;
     DROP TABLE IF EXISTS pharmacy_opening_hours CASCADE;
     DROP TABLE IF EXISTS pharmacies CASCADE;
     DROP TABLE IF EXISTS users CASCADE;
+    DROP TABLE IF EXISTS entity_versions CASCADE;
     DROP TYPE IF EXISTS day_of_week_enum CASCADE;
     """
 
@@ -63,16 +79,21 @@ def create_tables():
     );
     """
 
+    create_products = PRODUCTS_DDL
+
     create_masks = """
     CREATE TABLE IF NOT EXISTS masks (
         id SERIAL PRIMARY KEY,
         pharmacy_id INT NOT NULL,
-        name VARCHAR(255) NOT NULL,
+        product_id INT NOT NULL,
         price DOUBLE PRECISION DEFAULT 0,
         CONSTRAINT fk_pharmacy
             FOREIGN KEY (pharmacy_id) REFERENCES pharmacies(id)
-            ON DELETE CASCADE
+            ON DELETE CASCADE,
+        CONSTRAINT fk_product
+            FOREIGN KEY (product_id) REFERENCES products(id)
     );
+    CREATE INDEX IF NOT EXISTS ix_masks_product_id ON masks (product_id);
     """
 
     create_users = """
@@ -83,25 +104,12 @@ def create_tables():
     );
     """
 
-    create_purchase_histories = """
-    CREATE TABLE IF NOT EXISTS purchase_histories (
-        id SERIAL PRIMARY KEY,
-        user_id INT NOT NULL,
-        pharmacy_id INT NOT NULL,
-        mask_id INT,
-        mask_name VARCHAR(255),
-        quantity INT DEFAULT 1,
-        transaction_amount DOUBLE PRECISION DEFAULT 0,
-        transaction_date TIMESTAMP,
-        CONSTRAINT fk_user
-            FOREIGN KEY (user_id) REFERENCES users(id)
-            ON DELETE CASCADE,
-        CONSTRAINT fk_pharmacy
-            FOREIGN KEY (pharmacy_id) REFERENCES pharmacies(id)
-            ON DELETE CASCADE,
-        CONSTRAINT fk_mask
-            FOREIGN KEY (mask_id) REFERENCES masks(id)
-            ON DELETE CASCADE
+    create_purchase_histories = PARENT_DDL
+
+    create_entity_versions = """
+    CREATE TABLE IF NOT EXISTS entity_versions (
+        key VARCHAR(64) COLLATE "C" PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
     );
     """
 
@@ -123,9 +131,14 @@ def create_tables():
         cursor.execute(create_enum)
         cursor.execute(create_pharmacies)
         cursor.execute(create_pharmacy_opening_hours)
+        cursor.execute(create_products)
         cursor.execute(create_masks)
         cursor.execute(create_users)
         cursor.execute(create_purchase_histories)
+        create_default_partition(cursor)
+        cursor.execute(create_entity_versions)
+        # masks / 營業時間異動時自動遞增 entity_versions (ETag)
+        install_version_triggers(cursor)
 
         conn.commit()
         cursor.close()
@@ -177,6 +190,31 @@ def parse_opening_hours(opening_str: str):
                     print(f"[WARN] Unrecognized day '{d}'. Skipping.")
     return results
 
+# === 3.5) 商品字典 (products) ===
+def load_products(cursor):
+    """products 表 -> {name: id}"""
+    cursor.execute("SELECT id, name FROM products")
+    return {name: pid for pid, name in cursor.fetchall()}
+
+def get_or_create_product(cursor, products: dict, name: str) -> int:
+    """
+    依商品名稱取得 product_id，字典內沒有才寫入 products (brand / color / pack_size 只解析這一次)
+    """
+    if name in products:
+        return products[name]
+    brand, color, pack_size = parse_product_name(name)
+    cursor.execute(
+        """
+        INSERT INTO products (name, brand, color, pack_size)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+        RETURNING id
+        """,
+        (name, brand, color, pack_size)
+    )
+    products[name] = cursor.fetchone()[0]
+    return products[name]
+
 # === 4) 匯入 pharmacies.json → pharmacies, pharmacy_opening_hours, masks ===
 def import_pharmacies(pharmacies_json_path: str):
     """
@@ -208,6 +246,7 @@ def import_pharmacies(pharmacies_json_path: str):
         with open(pharmacies_json_path, "r", encoding="utf-8") as f:
             data = json.load(f)
 
+        products = load_products(cursor)
         inserted_count = 0
 
         for item in data:
@@ -234,15 +273,15 @@ def import_pharmacies(pharmacies_json_path: str):
                 """
                 cursor.execute(sql_oh, (pharmacy_id, dow, open_t, close_t))
 
-            # 插入口罩
+            # 插入口罩 (名稱轉成 product_id)
             for m in item.get("masks", []):
-                mask_name = m["name"]
+                product_id = get_or_create_product(cursor, products, m["name"])
                 mask_price = float(m["price"])
                 sql_mask = """
-                    INSERT INTO masks (pharmacy_id, name, price)
+                    INSERT INTO masks (pharmacy_id, product_id, price)
                     VALUES (%s, %s, %s)
                 """
-                cursor.execute(sql_mask, (pharmacy_id, mask_name, mask_price))
+                cursor.execute(sql_mask, (pharmacy_id, product_id, mask_price))
 
             inserted_count += 1
 
@@ -292,6 +331,23 @@ def import_users(users_json_path: str):
         with open(users_json_path, "r", encoding="utf-8") as f:
             data = json.load(f)
 
+        # 先建好資料涵蓋月份 (到未來 PARTITION_MONTHS_AHEAD 個月) 的 partition，
+        # 之後每筆紀錄直接寫進所屬月份的 partition
+        tx_months = [
+            datetime.strptime(ph.get("transactionDate", "2021-01-01 00:00:00"), "%Y-%m-%d %H:%M:%S")
+            for u in data for ph in u.get("purchaseHistories", [])
+        ]
+        this_month = month_start(datetime.now())
+        tx_months += [add_months(this_month, i) for i in range(PARTITION_MONTHS_AHEAD + 1)]
+        ensure_partitions(cursor, tx_months)
+
+        # 藥局、商品、口罩先整批載入記憶體，之後逐筆比對都是 dict 查詢
+        cursor.execute("SELECT id, name FROM pharmacies")
+        pharmacy_ids = {name: pid for pid, name in cursor.fetchall()}
+        products = load_products(cursor)
+        cursor.execute("SELECT id, pharmacy_id, product_id FROM masks")
+        mask_ids = {(ph_id, prod_id): mid for mid, ph_id, prod_id in cursor.fetchall()}
+
         user_count = 0
         purchase_count = 0
 
@@ -319,34 +375,24 @@ def import_users(users_json_path: str):
                 dt_obj = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
 
                 # 查找 pharmacy_id
-                sql_find_pharmacy = "SELECT id FROM pharmacies WHERE name=%s"
-                cursor.execute(sql_find_pharmacy, (pharmacy_name,))
-                row_p = cursor.fetchone()
-                if not row_p:
+                pharmacy_id = pharmacy_ids.get(pharmacy_name)
+                if pharmacy_id is None:
                     print(f"[WARN] Pharmacy '{pharmacy_name}' not found. Skipping.")
                     continue
-                pharmacy_id = row_p[0]
 
-                # 查找 mask_id
-                sql_find_mask = """
-                    SELECT id FROM masks
-                    WHERE pharmacy_id=%s AND name=%s
-                """
-                cursor.execute(sql_find_mask, (pharmacy_id, mask_name))
-                row_m = cursor.fetchone()
-                if not row_m:
+                # 商品名稱 -> product_id，再以 (pharmacy_id, product_id) 查找 mask_id
+                product_id = get_or_create_product(cursor, products, mask_name) if mask_name else None
+                mask_id = mask_ids.get((pharmacy_id, product_id))
+                if mask_id is None:
                     print(f"[WARN] Mask '{mask_name}' not found under pharmacy '{pharmacy_name}'. Skipping mask_id.")
-                    mask_id = None
-                else:
-                    mask_id = row_m[0]
 
-                # 預設 quantity=1
-                sql_insert_ph = """
-                    INSERT INTO purchase_histories
-                    (user_id, pharmacy_id, mask_id, mask_name, quantity, transaction_amount, transaction_date)
+                # 預設 quantity=1，直接寫入該月份的 partition
+                sql_insert_ph = f"""
+                    INSERT INTO {partition_name(dt_obj)}
+                    (user_id, pharmacy_id, mask_id, product_id, quantity, transaction_amount, transaction_date)
                     VALUES (%s, %s, %s, %s, 1, %s, %s)
                 """
-                cursor.execute(sql_insert_ph, (user_id, pharmacy_id, mask_id, mask_name, amt, dt_obj))
+                cursor.execute(sql_insert_ph, (user_id, pharmacy_id, mask_id, product_id, amt, dt_obj))
                 purchase_count += 1
 
         conn.commit()
@@ -360,7 +406,43 @@ def import_users(users_json_path: str):
         if conn:
             conn.close()
 
-# === 6) 主程式：建表 & 從JSON匯入 ===
+# === 6) 重設 ETag epoch ===
+def bump_version_epoch():
+    """
+    以當下毫秒時間設定 entity_versions 的 epoch，
+    重新匯入後，客戶端手上舊的 ETag 都不會再命中 (不會誤回 304)
+    """
+    conn = None
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port=DB_PORT
+        )
+        cursor = conn.cursor()
+        epoch = int(time.time() * 1000)
+        cursor.execute(
+            """
+            INSERT INTO entity_versions (key, version) VALUES ('epoch', %s)
+            ON CONFLICT (key) DO UPDATE
+            SET version = GREATEST(entity_versions.version + 1, EXCLUDED.version)
+            """,
+            (epoch,)
+        )
+        conn.commit()
+        cursor.close()
+        print("[INFO] Version epoch bumped.")
+    except Exception as e:
+        print("[ERROR] Failed to bump version epoch:", e)
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+# === 7) 主程式：建表 & 從JSON匯入 ===
 def main():
     # (1) 建表
     create_tables()
@@ -371,6 +453,9 @@ def main():
     # (3) 匯入 users.json
     import_users("users.json")
 
+    # (4) 讓所有舊 ETag 失效
+    bump_version_epoch()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,46 @@
+import asyncio
+
+from app.utils.admission import AdmissionGate
+
+
+def test_acquire_rejects_when_queue_is_full():
+    async def scenario():
+        gate = AdmissionGate("test", limit=1, queue_size=1, queue_timeout=1.0)
+        assert await gate.acquire()
+        queued = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert gate.waiting == 1
+        # 佇列已滿，不等待直接拒絕
+        assert await gate.acquire() is False
+        gate.release()
+        assert await queued
+        gate.release()
+        return gate.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["admitted"] == 2
+    assert stats["rejected"] == 1
+    assert stats["timed_out"] == 0
+    assert stats["active"] == 0
+    assert stats["queue_depth"] == 0
+
+
+def test_acquire_times_out_in_queue():
+    async def scenario():
+        gate = AdmissionGate("test", limit=1, queue_size=5, queue_timeout=0.01)
+        assert await gate.acquire()
+        assert await gate.acquire() is False
+        stats = gate.stats()
+        gate.release()
+        # 逾時的請求沒有佔住名額
+        assert await gate.acquire()
+        gate.release()
+        return stats, gate.stats()
+
+    during, after = asyncio.run(scenario())
+    assert during["timed_out"] == 1
+    assert during["rejected"] == 1
+    assert during["active"] == 1
+    assert during["queue_depth"] == 0
+    assert after["admitted"] == 2
+    assert after["active"] == 0
@@ -0,0 +1,26 @@
+from app.utils.compression import choose_encoding
+
+
+def test_choose_encoding_prefers_brotli_at_equal_q():
+    assert choose_encoding("gzip, deflate, br") == "br"
+    assert choose_encoding("br;q=1.0, gzip;q=1.0") == "br"
+
+
+def test_choose_encoding_uses_highest_q_value():
+    assert choose_encoding("br;q=0.5, gzip;q=0.8") == "gzip"
+    assert choose_encoding("gzip;q=0.2, br;q=0.9") == "br"
+    assert choose_encoding("GZIP ; q=0.7") == "gzip"
+
+
+def test_choose_encoding_q_zero_refuses_an_encoding():
+    assert choose_encoding("br;q=0, gzip") == "gzip"
+    assert choose_encoding("br;q=0, gzip;q=0") is None
+    assert choose_encoding("gzip;q=oops") is None
+
+
+def test_choose_encoding_wildcard_and_unsupported():
+    assert choose_encoding("*") == "br"
+    assert choose_encoding("br;q=0, *;q=0.5") == "gzip"
+    assert choose_encoding("identity") is None
+    assert choose_encoding("deflate, identity;q=0.5") is None
+    assert choose_encoding("") is None
@@ -0,0 +1,154 @@
+from datetime import date, datetime
+
+from app.utils.partitions import (
+    DEFAULT_PARTITION, PARENT_DDL, add_months, detach_expired_partitions, ensure_month_partition,
+    migrate_unpartitioned, month_start, partition_name, retention_cutoff
+)
+
+
+class RecordingCursor:
+    """記錄執行過的 SQL；查詢結果依 SQL 內容由 rules (片段 -> rows 或 params -> rows) 決定"""
+
+    def __init__(self, rules=None, rowcount=0):
+        self.rules = rules or {}
+        self.rowcount = rowcount
+        self.executed = []
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((" ".join(sql.split()), params))
+        self._rows = []
+        for fragment, rows in self.rules.items():
+            if fragment in sql:
+                self._rows = rows(params) if callable(rows) else rows
+                break
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+    @property
+    def statements(self):
+        return [sql for sql, _ in self.executed]
+
+
+def test_month_start_accepts_date_and_datetime():
+    assert month_start(date(2021, 2, 28)) == date(2021, 2, 1)
+    assert month_start(datetime(2021, 12, 31, 23, 59)) == date(2021, 12, 1)
+
+
+def test_add_months_crosses_year_boundaries():
+    assert add_months(date(2021, 1, 1), 1) == date(2021, 2, 1)
+    assert add_months(date(2021, 12, 1), 1) == date(2022, 1, 1)
+    assert add_months(date(2021, 1, 1), -1) == date(2020, 12, 1)
+    assert add_months(date(2021, 3, 1), -15) == date(2019, 12, 1)
+    assert add_months(date(2021, 3, 1), 24) == date(2023, 3, 1)
+
+
+def test_partition_name():
+    assert partition_name(datetime(2021, 3, 5, 10)) == "purchase_histories_202103"
+
+
+def test_retention_cutoff_includes_current_month():
+    today = date(2022, 3, 15)
+    assert retention_cutoff(1, today) == date(2022, 3, 1)
+    assert retention_cutoff(12, today) == date(2021, 4, 1)
+    assert retention_cutoff(3, date(2022, 1, 31)) == date(2021, 11, 1)
+
+
+def test_retention_cutoff_disabled():
+    assert retention_cutoff(0, date(2022, 3, 15)) is None
+    assert retention_cutoff(-1, date(2022, 3, 15)) is None
+
+
+def test_ensure_month_partition_skips_existing():
+    cursor = RecordingCursor({"to_regclass": [("purchase_histories_202103",)]})
+    assert ensure_month_partition(cursor, date(2021, 3, 20)) is False
+    assert cursor.executed == [("SELECT to_regclass(%s)", ("purchase_histories_202103",))]
+
+
+def test_ensure_month_partition_moves_rows_from_default_then_attaches():
+    cursor = RecordingCursor({
+        "to_regclass": lambda params: [(DEFAULT_PARTITION if params[0] == DEFAULT_PARTITION else None,)],
+    })
+    assert ensure_month_partition(cursor, datetime(2021, 12, 5, 8)) is True
+    assert cursor.statements == [
+        "SELECT to_regclass(%s)",
+        "CREATE TABLE purchase_histories_202112 "
+        "(LIKE purchase_histories INCLUDING DEFAULTS INCLUDING CONSTRAINTS)",
+        "SELECT to_regclass(%s)",
+        "WITH moved AS ( DELETE FROM purchase_histories_default "
+        "WHERE transaction_date >= %s AND transaction_date < %s RETURNING * ) "
+        "INSERT INTO purchase_histories_202112 SELECT * FROM moved",
+        "ALTER TABLE purchase_histories ATTACH PARTITION purchase_histories_202112 "
+        "FOR VALUES FROM ('2021-12-01') TO ('2022-01-01')",
+    ]
+    assert cursor.executed[3][1] == (date(2021, 12, 1), date(2022, 1, 1))
+
+
+def test_ensure_month_partition_without_default_partition():
+    cursor = RecordingCursor({"to_regclass": [(None,)]})
+    assert ensure_month_partition(cursor, date(2021, 3, 1)) is True
+    assert not any(sql.startswith("WITH moved") for sql in cursor.statements)
+    assert cursor.statements[-1].startswith("ALTER TABLE purchase_histories ATTACH PARTITION purchase_histories_202103")
+
+
+def test_migrate_unpartitioned_skips_partitioned_table():
+    cursor = RecordingCursor({"relkind": [("p",)]})
+    assert migrate_unpartitioned(cursor) is None
+    assert len(cursor.executed) == 1
+
+
+def test_migrate_unpartitioned_renames_legacy_and_copies_rows():
+    cursor = RecordingCursor({
+        "SELECT relkind": [("r",)],
+        "SELECT conname": [("purchase_histories_pkey",)],
+        "FROM pg_index": [("ix_purchase_histories_id",)],
+        "SELECT pg_get_serial_sequence": [("public.purchase_histories_id_seq",)],
+        "date_trunc": [(datetime(2021, 1, 1),), (datetime(2021, 3, 1),)],
+        "to_regclass(%s)": lambda params: [(params[0] if params[0] == DEFAULT_PARTITION else None,)],
+        "information_schema.columns": [("id",), ("user_id",), ("mask_name",), ("transaction_date",)],
+    }, rowcount=2)
+    assert migrate_unpartitioned(cursor) == 2
+
+    statements = cursor.statements
+    renames = [
+        "LOCK TABLE purchase_histories IN ACCESS EXCLUSIVE MODE",
+        "ALTER TABLE purchase_histories RENAME TO purchase_histories_legacy",
+        'ALTER TABLE purchase_histories_legacy RENAME CONSTRAINT "purchase_histories_pkey" '
+        'TO "purchase_histories_pkey_legacy"',
+        'ALTER INDEX "ix_purchase_histories_id" RENAME TO "ix_purchase_histories_id_legacy"',
+        "ALTER SEQUENCE public.purchase_histories_id_seq RENAME TO purchase_histories_legacy_id_seq",
+    ]
+    positions = [statements.index(sql) for sql in renames]
+    assert positions == sorted(positions)
+    # 舊表都改名之後才建新的 partitioned table
+    assert statements.index(" ".join(PARENT_DDL.split())) > positions[-1]
+    attached = [sql for sql in statements if "ATTACH PARTITION" in sql]
+    assert [sql.split()[5] for sql in attached] == ["purchase_histories_202101", "purchase_histories_202103"]
+
+    insert = next(sql for sql in statements if sql.startswith("INSERT INTO purchase_histories ("))
+    assert "(SELECT p.id FROM products p WHERE p.name = l.mask_name)" in insert
+    assert insert.endswith("FROM purchase_histories_legacy l WHERE l.transaction_date IS NOT NULL")
+    assert statements[-1].startswith("SELECT setval(pg_get_serial_sequence(%s, 'id')")
+
+
+def test_detach_expired_partitions_only_detaches_whole_months_before_cutoff():
+    cursor = RecordingCursor({"pg_inherits": [
+        ("purchase_histories_202203",), ("purchase_histories_default",),
+        ("purchase_histories_202111",), ("purchase_histories_202201",), ("purchase_histories_202112",),
+    ]})
+    detached = detach_expired_partitions(cursor, 3, today=date(2022, 3, 15))
+    assert detached == ["purchase_histories_202111", "purchase_histories_202112"]
+    assert cursor.statements[1:] == [
+        "ALTER TABLE purchase_histories DETACH PARTITION purchase_histories_202111",
+        "ALTER TABLE purchase_histories DETACH PARTITION purchase_histories_202112",
+    ]
+
+
+def test_detach_expired_partitions_disabled_runs_no_sql():
+    cursor = RecordingCursor()
+    assert detach_expired_partitions(cursor, 0, today=date(2022, 3, 15)) == []
+    assert cursor.executed == []
@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from app.utils.purchase_snapshot import COLUMNS, META_FILE, USERS_FILE, PurchaseSnapshot
+
+# (user_id, amount, quantity, transaction_date)，依時間排序，與匯出的順序相同
+ROWS = [
+    (1, 10.0, 2, datetime(2021, 1, 1, 10)),
+    (2, 25.0, 1, datetime(2021, 1, 2)),
+    (1, 20.0, 3, datetime(2021, 1, 3)),
+    (3, 5.0, 1, datetime(2021, 1, 5)),
+    (2, 1.0, 4, datetime(2021, 2, 1)),
+]
+
+
+def write_snapshot(directory, rows=ROWS):
+    user_ids, amounts, quantities, dates = zip(*rows)
+    arrays = {
+        "user_id": user_ids,
+        "pharmacy_id": [1] * len(rows),
+        "mask_id": [-1] * len(rows),
+        "product_id": [-1] * len(rows),
+        "quantity": quantities,
+        "amount": amounts,
+        "timestamp": dates,
+    }
+    for name, dtype in COLUMNS.items():
+        np.save(directory / f"{name}.npy", np.array(arrays[name], dtype=dtype))
+    (directory / META_FILE).write_text(json.dumps({
+        "exported_at": "2021-03-01T00:00:00", "rows": len(rows), "max_purchase_id": len(rows), "epoch": 0,
+    }))
+    (directory / USERS_FILE).write_text(json.dumps({"1": "Amy", "2": "Bob", "3": "Cat"}))
+    return PurchaseSnapshot(str(directory))
+
+
+def test_top_spenders_sums_amount_per_user_in_range(tmp_path):
+    snapshot = write_snapshot(tmp_path)
+    january = (datetime(2021, 1, 1), datetime(2021, 1, 31, 23, 59, 59))
+    assert snapshot.top_spenders(*january, 2) == [
+        {"user_id": 1, "user_name": "Amy", "total_spent": 30.0},
+        {"user_id": 2, "user_name": "Bob", "total_spent": 25.0},
+    ]
+    assert [row["user_id"] for row in snapshot.top_spenders(*january, 10)] == [1, 2, 3]
+    assert snapshot.top_spenders(*january, 0) == []
+
+
+def test_top_spenders_range_is_inclusive_and_timezone_aware(tmp_path):
+    snapshot = write_snapshot(tmp_path)
+    # 2021-01-02 09:00 +09:00 = 2021-01-02 00:00 UTC，剛好包含第二筆
+    end = datetime(2021, 1, 2, 9, tzinfo=timezone(timedelta(hours=9)))
+    assert snapshot.top_spenders(datetime(2021, 1, 2), end, 5) == [
+        {"user_id": 2, "user_name": "Bob", "total_spent": 25.0},
+    ]
+    assert snapshot.top_spenders(datetime(2021, 1, 6), datetime(2021, 1, 31), 5) == []
+
+
+def test_transaction_summary(tmp_path):
+    snapshot = write_snapshot(tmp_path)
+    assert snapshot.transaction_summary(datetime(2021, 1, 1), datetime(2021, 1, 31)) == (7, 60.0)
+    assert snapshot.transaction_summary(datetime(2020, 1, 1), datetime(2021, 12, 31)) == (11, 61.0)
+    assert snapshot.transaction_summary(datetime(2021, 1, 3), datetime(2021, 1, 3)) == (3, 20.0)
+    assert snapshot.transaction_summary(datetime(2022, 1, 1), datetime(2022, 1, 31)) == (0, 0.0)
+
+
+def test_covers_needs_a_current_snapshot_and_end_before_export(tmp_path):
+    snapshot = write_snapshot(tmp_path)
+    assert not snapshot.covers(datetime(2021, 1, 31))
+    snapshot.current = True
+    assert snapshot.covers(datetime(2021, 3, 1))
+    assert not snapshot.covers(datetime(2021, 3, 1, 0, 0, 1))
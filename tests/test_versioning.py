@@ -0,0 +1,30 @@
+from starlette.requests import Request
+
+from app.utils.versioning import _matching_etag
+
+ETAG = '"pharmacies-0.6-80df29e9"'
+
+
+def request(if_none_match=None):
+    headers = [] if if_none_match is None else [(b"if-none-match", if_none_match.encode())]
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": headers})
+
+
+def test_matching_etag_exact_and_weak():
+    assert _matching_etag(request(ETAG), ETAG) == ETAG
+    assert _matching_etag(request(f"W/{ETAG}"), ETAG) == f"W/{ETAG}"
+    assert _matching_etag(request('"pharmacies-0.7-80df29e9"'), ETAG) is None
+    assert _matching_etag(request(), ETAG) is None
+
+
+def test_matching_etag_returns_the_compressed_tag_the_client_sent():
+    for suffix in ("-br", "-gzip"):
+        sent = f'"pharmacies-0.6-80df29e9{suffix}"'
+        assert _matching_etag(request(f'"other", {sent}'), ETAG) == sent
+    assert _matching_etag(request('"pharmacies-0.6-80df29e9-zstd"'), ETAG) is None
+
+
+def test_matching_etag_wildcard_needs_an_existing_resource():
+    assert _matching_etag(request("*"), ETAG) == ETAG
+    assert _matching_etag(request("*"), ETAG, exists=lambda: True) == ETAG
+    assert _matching_etag(request("*"), ETAG, exists=lambda: False) is None